@@ -0,0 +1,362 @@
+"""Benchmark of the actiwatch actigraphy ingest paths.
+
+Synthetic Actiwatch/RPX exports are generated in several sizes and
+delimiters, and the anonymization, metadata extraction, transformation and
+Trino upload paths of the plugin are run against an in-process S3 stand-in
+(moto) and a fake DB-API cursor. Every case runs in its own process and
+reports throughput, peak RSS, peak traced memory and the blocks still
+allocated after a run.
+
+Run from the root of the edge module:
+
+    python mescobrad_edge/plugins/actiwatch_actigraphy_plugin/benchmarks/actigraphy_benchmark.py \
+        --days 1 7 30 --delimiters "," ";" "\\t" --output bench_output.txt
+"""
+
+import argparse
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Root of the edge module, so that the plugin package can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, os.pardir)))
+
+
+EPOCH_SECONDS = 15
+
+COLUMNS = ["Line", "Date", "Time", "Off-Wrist Status", "Activity", "Marker",
+           "White Light", "Red Light", "Green Light", "Blue Light",
+           "Sleep/Wake", "Interval Status"]
+
+PLUGIN_CONFIG = {
+    "OBJ_STORAGE_URL_LOCAL": None,
+    "OBJ_STORAGE_ACCESS_ID_LOCAL": "benchmark",
+    "OBJ_STORAGE_ACCESS_SECRET_LOCAL": "benchmark",
+    "OBJ_STORAGE_BUCKET_LOCAL": "benchmark-local",
+    "OBJ_STORAGE_URL": None,
+    "OBJ_STORAGE_ACCESS_ID": "benchmark",
+    "OBJ_STORAGE_ACCESS_SECRET": "benchmark",
+    "OBJ_STORAGE_BUCKET": "benchmark-cloud",
+    "OBJ_STORAGE_REGION": "us-east-1",
+    "OBJ_STORAGE_TABLE": "benchmark",
+}
+
+
+def generate_actigraphy_file(path, days, delimiter):
+    """Write synthetic Actiwatch export with the given number of days of
+    15 second epochs"""
+    import numpy as np
+
+    def row(*values):
+        return delimiter.join(f'"{value}"' for value in values) + "\r\r\n"
+
+    epochs = days * 24 * 3600 // EPOCH_SECONDS
+    start = datetime.datetime(2023, 3, 6, 12, 0, 0)
+    end = start + datetime.timedelta(seconds=EPOCH_SECONDS * (epochs - 1))
+
+    header = [
+        row("Actiware Export File  (Version 05.00 )"),
+        row("Filename:", "synthetic.awd"),
+        "\r\r\n",
+        row("-------------------- Subject Properties--------------------"),
+        "\r\r\n",
+        row("Identity:", "SYNTHETIC"),
+        row("Full Name:", "Jane Doe"),
+        row("Street Address:", "1 Main Street"),
+        row("Gender:", "F"),
+        row("Date of Birth:", "01/01/1970"),
+        row("Age (at start of data collection):", "53", "years"),
+        "\r\r\n",
+        row("----------------- Actiwatch Data Properties ----------------"),
+        "\r\r\n",
+        row("Actiwatch Type:", "Spectrum Plus"),
+        row("Data Collection Start Date:", f"{start:%d/%m/%Y}"),
+        row("Data Collection Start Time:", f"{start:%H:%M:%S}"),
+        row("Data Collection End Date:", f"{end:%d/%m/%Y}"),
+        row("Data Collection End Time:", f"{end:%H:%M:%S}"),
+        row("Time Zone:", "(UTC+01:00) Brussels, Copenhagen, Madrid, Paris"),
+        row("Epoch Length:", str(EPOCH_SECONDS), "seconds"),
+        row("Actiwatch Serial Number:", "A00000S"),
+        "\r\r\n",
+        row("-------------------- Epoch-by-Epoch Data -------------------"),
+        "\r\r\n",
+        row("Column Title", "Notes"),
+        row("------------------", "---------"),
+    ]
+    header += [row(f"{column}:", column) for column in COLUMNS]
+    header += ["\r\r\n", row(*COLUMNS), "\r\r\n"]
+
+    rng = np.random.default_rng(days)
+    with open(path, mode="w", newline="") as file:
+        file.write("".join(header))
+
+        # Epochs are written one day at a time to bound the memory
+        epochs_per_day = 24 * 3600 // EPOCH_SECONDS
+        for day in range(days):
+            first = day * epochs_per_day
+            times = [start + datetime.timedelta(seconds=EPOCH_SECONDS * epoch)
+                     for epoch in range(first, first + epochs_per_day)]
+            activity = rng.poisson(120, epochs_per_day)
+            light = rng.gamma(2.0, 150.0, (epochs_per_day, 4)).round(2)
+            off_wrist = (rng.random(epochs_per_day) < 0.01).astype(int)
+            file.write("".join(
+                row(first + epoch + 1, f"{epoch_time:%d/%m/%Y}",
+                    f"{epoch_time:%H:%M:%S}", off_wrist[epoch],
+                    activity[epoch], 0, *light[epoch], 1, "ACTIVE")
+                for epoch, epoch_time in enumerate(times)))
+
+    return epochs
+
+
+class FakeCursor():
+    """DB-API cursor which only records the executed statements"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, parameters=None):
+        self.connection.statements += 1
+        self.connection.statement_bytes += len(sql)
+        if parameters is not None:
+            self.connection.parameters += len(parameters)
+
+    def fetchall(self):
+        return [[1]]
+
+
+class FakeConnection():
+    """DB-API connection standing in for the Trino connection"""
+
+    def __init__(self):
+        self.statements = 0
+        self.statement_bytes = 0
+        self.parameters = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+def create_plugin():
+    """Create the plugin without the virtualenv setup and the configuration
+    file of the edge module"""
+    from mescobrad_edge.plugins.actiwatch_actigraphy_plugin.entrypoint import \
+        GenericPlugin
+
+    plugin = object.__new__(GenericPlugin)
+    for key, value in PLUGIN_CONFIG.items():
+        plugin.__dict__[f"__{key}__"] = value
+
+    return plugin
+
+
+def run_anonymization(plugin, case):
+    header, body_offset, _, _ = plugin.anonymize_actigraphy_file(
+        case["path"], case["delimiter"])
+
+    # Consume the anonymized stream as the uploader does
+    size = 0
+    for chunk in plugin.iter_anonymized_actigraphy_file(case["path"], header,
+                                                        body_offset):
+        size += len(chunk)
+
+    return {"bytes": size}
+
+
+def run_metadata_extraction(plugin, case):
+    plugin.extract_metadata_information(case["header"], case["delimiter"])
+
+    return {"rows": len(case["header"])}
+
+
+def run_transform(plugin, case):
+    rows = 0
+    for chunk in plugin.transform_input_data(case["epochs"], "synthetic.csv",
+                                             "workspace", "pseudoMRN", None,
+                                             None, None, chunk_size=100000):
+        rows += chunk.shape[0]
+
+    return {"rows": rows}
+
+
+def run_trino_upload(plugin, case):
+    connection = FakeConnection()
+    stats = plugin.upload_data_on_trino("benchmark", "benchmark",
+                                        case["transformed"], connection)
+
+    return {"rows": stats["rows"], "batches": stats["batches"],
+            "statement_bytes": connection.statement_bytes}
+
+
+def run_cloud_upload(plugin, case):
+    from mescobrad_edge.plugins.actiwatch_actigraphy_plugin.entrypoint import \
+        IterableReader
+
+    header, body_offset, _, _ = plugin.anonymize_actigraphy_file(
+        case["path"], case["delimiter"])
+    plugin.upload_file_on_cloud(
+        "actigraphy_files/synthetic.csv",
+        IterableReader(plugin.iter_anonymized_actigraphy_file(
+            case["path"], header, body_offset)),
+        "text/csv")
+
+    return {"bytes": os.path.getsize(case["path"])}
+
+
+BENCHMARKS = {
+    "anonymize_actigraphy_file": run_anonymization,
+    "extract_metadata_information": run_metadata_extraction,
+    "transform_input_data": run_transform,
+    "upload_data_on_trino": run_trino_upload,
+    "upload_file_on_cloud": run_cloud_upload,
+}
+
+
+def prepare_case(plugin, benchmark, path, delimiter):
+    """Inputs of the benchmark which are not measured"""
+    import numpy as np
+    import pandas as pd
+
+    case = {"path": path, "delimiter": delimiter}
+
+    if benchmark == "extract_metadata_information":
+        case["header"], _, _, _ = plugin.anonymize_actigraphy_file(path,
+                                                                    delimiter)
+
+    if benchmark in ("transform_input_data", "upload_data_on_trino"):
+        header, body_offset, _, _ = plugin.anonymize_actigraphy_file(
+            path, delimiter)
+        with open(path, mode="rb") as file:
+            file.seek(body_offset)
+            body = file.read().replace(b"\r\r\n", b"\r\n").decode("utf-8")
+
+        # Epoch table starts at the row with the column names
+        column_names = delimiter.join(f'"{column}"' for column in COLUMNS)
+        epochs = pd.read_csv(io.StringIO(body[body.index(column_names):]),
+                             sep=delimiter,
+                             usecols=["Activity", "White Light", "Red Light",
+                                      "Green Light", "Off-Wrist Status"])
+        case["epochs"] = epochs.astype(np.float64)
+
+    if benchmark == "upload_data_on_trino":
+        case["transformed"] = plugin.transform_input_data(
+            case["epochs"], "synthetic.csv", "workspace", "pseudoMRN", None,
+            None, None)
+        del case["epochs"]
+
+    return case
+
+
+def run_case(benchmark, path, delimiter, repeat):
+    """Run one benchmark case, in its own process"""
+    import warnings
+    import boto3
+    from moto import mock_aws
+
+    warnings.simplefilter("ignore")
+
+    with mock_aws():
+        s3 = boto3.client("s3", region_name=PLUGIN_CONFIG["OBJ_STORAGE_REGION"])
+        s3.create_bucket(Bucket=PLUGIN_CONFIG["OBJ_STORAGE_BUCKET_LOCAL"])
+        s3.create_bucket(Bucket=PLUGIN_CONFIG["OBJ_STORAGE_BUCKET"])
+
+        plugin = create_plugin()
+        case = prepare_case(plugin, benchmark, path, delimiter)
+
+        # Warm up imports and clients
+        BENCHMARKS[benchmark](plugin, case)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        timings = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            output = BENCHMARKS[benchmark](plugin, case)
+            timings.append(time.perf_counter() - start_time)
+
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # Memory is traced in a separate run, tracing slows it down. The
+        # snapshot holds only the blocks which are still allocated after the
+        # run, not every allocation made during it
+        tracemalloc.start()
+        blocks_before = sys.getallocatedblocks()
+        BENCHMARKS[benchmark](plugin, case)
+        retained_traced, peak_traced = tracemalloc.get_traced_memory()
+        retained_blocks = sum(stat.count for stat in
+                              tracemalloc.take_snapshot().statistics("filename"))
+        blocks_after = sys.getallocatedblocks()
+        tracemalloc.stop()
+
+    seconds = min(timings)
+    file_size = os.path.getsize(path)
+
+    return {
+        "benchmark": benchmark,
+        "seconds": seconds,
+        "file_mb_per_second": file_size / 2**20 / seconds,
+        "rows_per_second": output["rows"] / seconds if "rows" in output
+                           else None,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": rss_after / 1024,
+        "peak_rss_growth_mb": (rss_after - rss_before) / 1024,
+        "peak_traced_mb": peak_traced / 2**20,
+        "retained_traced_mb": retained_traced / 2**20,
+        "retained_blocks": retained_blocks,
+        "allocated_blocks_delta": blocks_after - blocks_before,
+        **output
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 7, 30])
+    parser.add_argument("--delimiters", nargs="+", default=[",", ";", "\\t"])
+    parser.add_argument("--benchmarks", nargs="+", default=list(BENCHMARKS),
+                        choices=list(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write results as JSON lines")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for days in args.days:
+            for delimiter in args.delimiters:
+                delimiter = delimiter.replace("\\t", "\t")
+                path = os.path.join(tmp_dir, f"synthetic_{days}d.csv")
+                epochs = generate_actigraphy_file(path, days, delimiter)
+
+                for benchmark in args.benchmarks:
+                    with context.Pool(1) as pool:
+                        result = pool.apply(run_case, (benchmark, path,
+                                                       delimiter, args.repeat))
+                    result.update({"days": days, "epochs": epochs,
+                                   "delimiter": delimiter,
+                                   "file_mb": os.path.getsize(path) / 2**20})
+                    results.append(result)
+
+                    print(f"{benchmark:30} {days:3}d {delimiter!r:5} "
+                          f"{result['seconds']:9.3f}s "
+                          f"{result['file_mb_per_second']:9.1f} MB/s "
+                          f"rss {result['peak_rss_mb']:8.1f} MB "
+                          f"(+{result['peak_rss_growth_mb']:.1f}) "
+                          f"traced {result['peak_traced_mb']:8.1f} MB "
+                          f"retained {result['retained_blocks']} blocks",
+                          flush=True)
+
+    if args.output is not None:
+        with open(args.output, mode="w") as file:
+            for result in results:
+                file.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,189 @@
 from mescobrad_edge.plugins.actiwatch_actigraphy_plugin.models.plugin import \
     EmptyPlugin, PluginActionResponse, PluginExchangeMetadata
 
+import contextlib
+import io
+import re
+import time
+
+
+FILE_PID_MAPPING = "file_pid/filename_pid.csv"
+FILE_PID_SHARDS_PREFIX = "file_pid/shards/"
+FILE_PID_COLUMNS = ['filename', 'personal_id', 'pseudoMRN', 'MRN']
+CONTENT_HASH_PREFIX = "content_hash/"
+RECORDINGS_PREFIX = "recordings/"
+DEDUP_CACHE_DIR = \
+    "mescobrad_edge/plugins/actiwatch_actigraphy_plugin/dedup_cache/"
+JOURNAL_PREFIX = "journal/"
+JOURNAL_DIR = "mescobrad_edge/plugins/actiwatch_actigraphy_plugin/journal/"
+COMPRESSION_BLOCK_BYTES = 1024 * 1024
+INGEST_CATALOG_PATH = \
+    "mescobrad_edge/plugins/actiwatch_actigraphy_plugin/ingest_catalog.csv"
+INGEST_CATALOG_COLUMNS = ['source', 'pseudoMRN', 'workspace_id',
+                          'start_time', 'end_time', 'content_hash']
+REDACTION_RULES = "*name*,*identity*,*initials*,*street*,*address*,*city*," \
+    "*cities*,*state*,*zip*,*country*,*phone*,*gender*,*birth*,age*,dob," \
+    "*patient*,zone,*latitude*,*longitude*,*altitude*,*geolocation*," \
+    "*location*"
+SUBJECT_PROPERTIES_RULE = "subject_properties"
+# Formats in the order of the day first parser, which reads "2000-01-02" as
+# 1st of February
+DATE_OF_BIRTH_FORMATS = ["%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y", "%Y-%d-%m",
+                         "%Y-%m-%d"]
+COLLECTION_TIME_PATTERN = re.compile(rb'data collection', re.IGNORECASE)
+
+
+class HeaderRedactor():
+    """Redact the values of the header lines which match any of the rules.
+
+    A rule is a word matched case-insensitively anywhere in the line, in the
+    field name and in the values, so that personal information under a
+    neutral field name is redacted also. A leading or trailing '*' allows
+    the word to be a part of a longer word, otherwise the word has to start
+    or end at a word boundary, which is also a change from lower to upper
+    case, e.g. 'age*' matches "Age", "Ages" and "PatientAge" but not
+    "Average". The words of all rules are compiled into a single pattern,
+    which works on the undecoded lines.
+    """
+
+    WORD_BYTES = frozenset(b'abcdefghijklmnopqrstuvwxyz'
+                           b'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
+    LOWER_BYTES = frozenset(b'abcdefghijklmnopqrstuvwxyz')
+    UPPER_BYTES = frozenset(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+    def __init__(self, rules, delimiter):
+        self.rules = [(rule.strip(), rule.strip().strip('*').lower().encode(
+                       'utf-8')) for rule in rules if rule.strip('* ')]
+        self.delimiter = delimiter.encode('utf-8')
+
+        # The words are factored into a trie of alternatives, so that the
+        # pattern fails on the first byte for most positions. Word
+        # boundaries are checked only where a word is found.
+        pattern = self.trie_pattern([word for _, word in self.rules])
+        self.pattern = re.compile(pattern or rb'(?!)', re.IGNORECASE)
+
+    @classmethod
+    def trie_pattern(cls, words):
+        trie = {}
+        for word in words:
+            node = trie
+            for byte in word:
+                node = node.setdefault(bytes([byte]), {})
+            node[b''] = {}
+
+        def build(node):
+            alternatives = [re.escape(byte) + build(child)
+                            for byte, child in sorted(node.items()) if byte]
+            if not alternatives:
+                return b''
+            pattern = alternatives[0] if len(alternatives) == 1 else \
+                b'(?:' + b'|'.join(alternatives) + b')'
+            return b'(?:' + pattern + b')?' if b'' in node else pattern
+
+        return build(trie)
+
+    def field_end(self, line):
+        end = line.find(self.delimiter)
+        return len(line) if end < 0 else end
+
+    def is_boundary(self, line, position):
+        """Check if a word can start or end at the position of the line"""
+        if position == 0 or position >= len(line):
+            return True
+
+        before = line[position - 1]
+        after = line[position]
+        return before not in self.WORD_BYTES or \
+            after not in self.WORD_BYTES or \
+            (before in self.LOWER_BYTES and after in self.UPPER_BYTES)
+
+    def match(self, line):
+        """Return the rule matching the line, or None"""
+        match = self.pattern.search(line)
+        lowered_line = None
+        while match is not None:
+            start = match.start()
+            if lowered_line is None:
+                lowered_line = line.lower()
+            for rule, word in self.rules:
+                if lowered_line.startswith(word, start) and (
+                        rule.startswith('*') or
+                        self.is_boundary(line, start)) and (
+                        rule.endswith('*') or
+                        self.is_boundary(line, start + len(word))):
+                    return rule
+            match = self.pattern.search(line, start + 1)
+
+        return None
+
+    def redact(self, line):
+        """Keep the field name of the line and replace its value with None"""
+        return line[:self.field_end(line)] + self.delimiter + b'None\r\n'
+
+    def report(self, line_number, line, rule):
+        """Describe a redaction without its redacted value"""
+        return {"line": line_number,
+                "field": line[:self.field_end(line)].decode(
+                    'utf-8', errors='replace').strip().strip('"'),
+                "rule": rule}
+
+    def redact_lines(self, lines):
+        """Redact the matching lines, returns the lines and the report of
+        the redactions"""
+        redacted = []
+        report = []
+        for line_number, line in enumerate(lines, start=1):
+            rule = self.match(line)
+            if rule is not None:
+                report.append(self.report(line_number, line, rule))
+                line = self.redact(line)
+            redacted.append(line)
+
+        return redacted, report
+
+
+class IterableReader(io.RawIOBase):
+    """Read-only file object over an iterable of bytes chunks, so that
+    generated content can be streamed without joining it in memory"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        # Fill the whole buffer unless the chunks are exhausted, readers
+        # such as the multipart upload treat short reads as end of data
+        size = 0
+        while size < len(b):
+            if not self.buffer:
+                try:
+                    self.buffer = memoryview(next(self.chunks))
+                except StopIteration:
+                    break
+                continue
+
+            read_size = min(len(b) - size, len(self.buffer))
+            b[size:size + read_size] = self.buffer[:read_size]
+            self.buffer = self.buffer[read_size:]
+            size += read_size
+
+        return size
+
 class GenericPlugin(EmptyPlugin):
-    def execute_sql_on_trino(self, sql, conn):
+    def execute_sql_on_trino(self, sql, conn, parameters=None):
         """Generic function to execute a SQL statement"""
 
         # Get a cursor from the connection object
         cur = conn.cursor()
 
         # Execute sql statement
-        cur.execute(sql)
+        if parameters is None:
+            cur.execute(sql)
+        else:
+            cur.execute(sql, parameters)
 
         # Get the results from the cluster
         rows = cur.fetchall()
@@ -18,172 +192,1555 @@ class GenericPlugin(EmptyPlugin):
         return rows
 
     def transform_input_data(self, data, source_name, workspace_id, pseudoMRN,
-                             metadata_file_name, startdate_time, enddate_time):
-        """Transform input data into table suitable for creating query"""
+                             metadata_file_name, startdate_time, enddate_time,
+                             chunk_size=None):
+        """Transform input data into table suitable for creating query.
+
+        The table is built directly from the column arrays, without
+        intermediate copies of the whole table. If chunk_size is given, a
+        generator of tables with at most chunk_size rows is returned instead,
+        so that the memory stays bounded for inputs of any length.
+        """
+        import numpy as np
+        import pandas as pd
 
-        data['startdate_time'] = str(startdate_time)
-        data['enddate_time'] = str(enddate_time)
+        # Values of the variables, either column arrays or single values
+        # repeated in every row
+        variables = {column: data[column].to_numpy(dtype=object)
+                     for column in data.columns}
 
-        data["pseudoMRN"] = pseudoMRN
+        variables['startdate_time'] = str(startdate_time)
+        variables['enddate_time'] = str(enddate_time)
+
+        variables["pseudoMRN"] = str(pseudoMRN)
 
         if metadata_file_name is not None:
-            data["metadata_file_name"] = metadata_file_name
+            variables["metadata_file_name"] = str(metadata_file_name)
 
-        # Add rowid column representing id of the row in the file
-        data["rowid"] = data.index + 1
+        variable_names = np.array(list(variables.keys()), dtype=object)
+        variable_values = list(variables.values())
 
-        # Insert source column representing name of the source file
-        data.insert(0, "source", source_name)
+        # Rowid column representing id of the row in the file
+        rowids = data.index.to_numpy() + 1
 
-        # Transform table into table with 5 columns:
-        # source, rowid, variable_name, variable_value, workspace_id
-        data = data.melt(id_vars=["source","rowid"])
-        data = data.sort_values(by=['rowid'])
+        def transform_rows(start, end):
+            # As a variable values type string is expected, values of each
+            # row are placed next to each other
+            values = np.empty((end - start, len(variable_values)), dtype=object)
+            for position, value in enumerate(variable_values):
+                if isinstance(value, str):
+                    values[:, position] = value
+                else:
+                    values[:, position] = value[start:end].astype(str)
+
+            rows_count = values.size
+
+            # Table with 5 columns:
+            # source, rowid, variable_name, variable_value, workspace_id
+            return pd.DataFrame({
+                "source": np.full(rows_count, source_name, dtype=object),
+                "rowid": np.repeat(rowids[start:end], len(variable_names)),
+                "variable": np.tile(variable_names, end - start),
+                "value": values.ravel(),
+                "workspace_id": np.full(rows_count, workspace_id, dtype=object)
+            })
+
+        if chunk_size is None:
+            return transform_rows(0, data.shape[0])
+
+        def transform_chunks():
+            rows_per_chunk = max(1, chunk_size // len(variable_names))
+            for start in range(0, data.shape[0], rows_per_chunk):
+                yield transform_rows(start,
+                                     min(start + rows_per_chunk, data.shape[0]))
+
+        return transform_chunks()
+
+    def extract_epoch_data(self, raw, source_name, workspace_id, pseudoMRN):
+        """Extract epoch by epoch series from the pyActigraphy recording into
+        typed table with one row per epoch"""
+        import numpy as np
+        import pandas as pd
 
-        # As a variable values type string is expected
-        data = data.astype({"value":"str"})
+        index = raw.data.index
+
+        def channel(name):
+            # Light channels which are not recorded raise ValueError
+            try:
+                series = getattr(raw, name)
+            except ValueError:
+                series = None
+
+            if series is None:
+                return np.full(len(index), np.nan)
+
+            values = series.reindex(index).to_numpy(dtype=float)
+
+            # pyActigraphy keeps light levels as log10(light + 1), store the
+            # recorded levels instead, without the floating point noise of
+            # the inverse transform
+            if name.endswith("_light"):
+                values = np.round(np.power(10.0, values) - 1, 6)
+
+            return values
+
+        epoch_data = pd.DataFrame({
+            "source": source_name,
+            "pseudomrn": pseudoMRN,
+            "workspace_id": workspace_id,
+            "epoch_time": index.to_numpy(),
+            "activity": raw.data.to_numpy(dtype=float),
+            "white_light": channel("white_light"),
+            "red_light": channel("red_light"),
+            "green_light": channel("green_light"),
+            "off_wrist": channel("off_wrist")
+        })
+
+        return epoch_data
+
+    def select_new_epochs(self, epoch_data, recording):
+        """Keep the epochs after the last epoch of the recording which is
+        already in the epoch table"""
+        import pandas as pd
 
-        # Add workspace id into workspace column of the table
-        data.insert(4, "workspace_id", workspace_id)
+        since_epoch_time = recording["since_epoch_time"]
+        if since_epoch_time is not None:
+            epoch_data = epoch_data[epoch_data["epoch_time"] >
+                                    pd.Timestamp(since_epoch_time)]
+
+        return epoch_data
+
+    def create_table_once(self, table, sql_statement, conn):
+        """Run the statement which creates the table, given by its fully
+        qualified name, once per plugin instance. The statement creates the
+        table only if it doesn't exist yet."""
+
+        created_tables = self.__dict__.setdefault("__CREATED_TABLES__", set())
+        if table in created_tables:
+            return
+
+        self.execute_sql_on_trino(sql=sql_statement, conn=conn)
+
+        created_tables.add(table)
+
+    def create_epoch_table(self, schema_name, table_name, conn):
+        """Create partitioned Iceberg table for epoch by epoch data, if it
+        doesn't exist yet"""
+
+        table = f"iceberg.{schema_name}.{table_name}"
+        sql_statement = "CREATE TABLE IF NOT EXISTS {table} (\
+                source varchar, \
+                pseudomrn varchar, \
+                workspace_id varchar, \
+                epoch_time timestamp(6), \
+                activity double, \
+                white_light double, \
+                red_light double, \
+                green_light double, \
+                off_wrist double) \
+            WITH (partitioning = ARRAY['workspace_id', 'day(epoch_time)'])\
+            ".format(table=table)
+        self.create_table_once(table, sql_statement, conn)
+
+    def summarize_epoch_data(self, epoch_data, frequency):
+        """Aggregate the epoch data into hourly and daily summaries and one
+        summary of the whole recording with the nonparametric metrics
+        IS, IV and RA, computed as in pyActigraphy on the non-binarized
+        activity"""
+        import numpy as np
+        import pandas as pd
 
-        return data
+        frequency = pd.Timedelta(frequency)
+        data = epoch_data.set_index("epoch_time")[
+            ["activity", "white_light", "red_light", "green_light",
+             "off_wrist"]]
+        activity = data["activity"]
+
+        def aggregate(groups):
+            return pd.DataFrame({
+                "epochs": groups["activity"].count(),
+                "activity_sum": groups["activity"].sum(),
+                "activity_mean": groups["activity"].mean(),
+                "white_light_mean": groups["white_light"].mean(),
+                "red_light_mean": groups["red_light"].mean(),
+                "green_light_mean": groups["green_light"].mean(),
+                "off_wrist_seconds":
+                    groups["off_wrist"].sum(min_count=1) *
+                    frequency.total_seconds()
+            })
+
+        summaries = []
+        for period, rule in (("hour", "1h"), ("day", "1D")):
+            summary = aggregate(data.resample(rule))
+            # Periods without any epoch are gaps of the recording
+            summary = summary[data["activity"].resample(rule).size() > 0]
+            summary.insert(0, "period", period)
+            summaries.append(summary)
+
+        recording = aggregate(data.groupby(np.zeros(len(data), dtype=int)))
+        recording.index = data.index[:1]
+        recording.insert(0, "period", "recording")
+
+        # Hourly activity for IS and IV from the start of the recording,
+        # hours with missing epochs are missing as a whole
+        hourly = activity.resample("1h", origin="start").sum().where(
+            activity.isna().resample("1h", origin="start").sum() == 0)
+        recording["interdaily_stability"] = hourly.groupby(
+            hourly.index.hour).mean().var() / hourly.var()
+        recording["intradaily_variability"] = \
+            hourly.diff(1).pow(2).mean() / hourly.var()
+
+        # RA from the least active 5 hours and the most active 10 hours of
+        # the average daily profile, which is only complete for recordings
+        # of at least one day
+        profile = activity.groupby([activity.index.hour,
+                                    activity.index.minute,
+                                    activity.index.second]).mean()
+        relative_amplitude = np.nan
+        if len(profile) == pd.Timedelta("1D") // frequency:
+            cyclic = pd.concat([profile, profile], ignore_index=True)
+            l5_epochs = pd.Timedelta("5h") // frequency
+            m10_epochs = pd.Timedelta("10h") // frequency
+            l5 = cyclic.rolling(l5_epochs).sum().min() / l5_epochs
+            m10 = cyclic.rolling(m10_epochs).sum().max() / m10_epochs
+            relative_amplitude = (m10 - l5) / (m10 + l5)
+        recording["relative_amplitude"] = relative_amplitude
+
+        summary = pd.concat(summaries + [recording])
+        summary.index.name = "period_start"
+        summary = summary.reset_index()
+        summary["epochs"] = summary["epochs"].astype("int64")
+        for column in ("source", "pseudomrn", "workspace_id"):
+            summary.insert(0, column, epoch_data[column].iloc[0]
+                           if len(epoch_data) else None)
+
+        return summary[["source", "pseudomrn", "workspace_id", "period",
+                        "period_start", "epochs", "activity_sum",
+                        "activity_mean", "white_light_mean", "red_light_mean",
+                        "green_light_mean", "off_wrist_seconds",
+                        "interdaily_stability", "intradaily_variability",
+                        "relative_amplitude"]]
+
+    def create_summary_table(self, schema_name, table_name, conn):
+        """Create partitioned Iceberg table for the activity summaries, if it
+        doesn't exist yet"""
+
+        table = f"iceberg.{schema_name}.{table_name}"
+        sql_statement = "CREATE TABLE IF NOT EXISTS {table} (\
+                source varchar, \
+                pseudomrn varchar, \
+                workspace_id varchar, \
+                period varchar, \
+                period_start timestamp(6), \
+                epochs bigint, \
+                activity_sum double, \
+                activity_mean double, \
+                white_light_mean double, \
+                red_light_mean double, \
+                green_light_mean double, \
+                off_wrist_seconds double, \
+                interdaily_stability double, \
+                intradaily_variability double, \
+                relative_amplitude double) \
+            WITH (partitioning = ARRAY['workspace_id', 'period'])\
+            ".format(table=table)
+        self.create_table_once(table, sql_statement, conn)
+
+    def upload_summary_on_cloud(self, summary, source_name):
+        """Upload the activity summary of the actigraphy file as Parquet
+        object next to the anonymized file"""
+        import os
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pandas(summary, preserve_index=False),
+                       buffer, compression="snappy", coerce_timestamps="us",
+                       allow_truncated_timestamps=True)
+
+        obj_name_summary = \
+            f"actigraphy_summaries/{os.path.splitext(source_name)[0]}.parquet"
+        self.upload_file_on_cloud(obj_name_summary, buffer.getvalue(),
+                                  "application/vnd.apache.parquet")
+
+        return buffer.getbuffer().nbytes
+
+    def export_epoch_parquet(self, epoch_data, header, delimiter, source_name,
+                             startdate_time, enddate_time):
+        """Upload the epoch data of the actigraphy file as compressed Parquet
+        object indexed by the epoch time, the anonymized header is kept in
+        the key-value metadata of the file"""
+        import json
+        import os
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(epoch_data.set_index("epoch_time"),
+                                     preserve_index=True)
+
+        header_metadata = {
+            "source": source_name,
+            "delimiter": delimiter,
+            "start_time": str(startdate_time),
+            "end_time": str(enddate_time),
+            "header": [line.decode("utf-8", errors="replace").rstrip("\r\n")
+                       for line in header]
+        }
+        table = table.replace_schema_metadata({
+            **table.schema.metadata,
+            b"actigraphy": json.dumps(header_metadata).encode("utf-8")
+        })
+
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer,
+                       compression=self.get_config_value(
+                           "PARQUET_COMPRESSION", "zstd"),
+                       coerce_timestamps="us",
+                       allow_truncated_timestamps=True)
+
+        obj_name_parquet = \
+            f"{self.get_config_value('PARQUET_PREFIX', 'actigraphy_parquet/')}" \
+            f"{os.path.splitext(source_name)[0]}.parquet"
+        self.upload_file_on_cloud(obj_name_parquet, buffer.getvalue(),
+                                  "application/vnd.apache.parquet")
+
+        return buffer.getbuffer().nbytes
+
+    def create_parquet_table(self, schema_name, table_name, conn):
+        """Register the exported Parquet objects as external Hive table, if
+        it doesn't exist yet. New objects are visible without further
+        registration."""
+
+        table = f"{self.get_config_value('PARQUET_CATALOG', 'hive')}." \
+            f"{schema_name}.{table_name}"
+        sql_statement = "CREATE TABLE IF NOT EXISTS {table} (\
+                source varchar, \
+                pseudomrn varchar, \
+                workspace_id varchar, \
+                activity double, \
+                white_light double, \
+                red_light double, \
+                green_light double, \
+                off_wrist double, \
+                epoch_time timestamp(3)) \
+            WITH (external_location = 's3://{bucket}/{location}', \
+            format = 'PARQUET')".format(
+                table=table, bucket=self.__OBJ_STORAGE_BUCKET__,
+                location=self.get_config_value("PARQUET_PREFIX",
+                                               "actigraphy_parquet/"))
+        self.create_table_once(table, sql_statement, conn)
+
+    def split_insert_batches(self, data, max_statement_bytes):
+        """Split rows into batches so that the insert statement with inlined
+        parameter values stays under the maximal statement size. Returns
+        list of (start, end) row ranges.
+
+        The size of every row is an upper bound of its part of the statement
+        which the Trino client sends, EXECUTE IMMEDIATE '<insert>' USING
+        <literals>: the "(?, ..., ?), " placeholders of the row in the insert
+        and the literals of its values, each followed by a comma. The fixed
+        part of the statement is not counted here.
+        """
+        import numpy as np
+
+        row_bytes = np.full(data.shape[0], 3 * len(data.columns) + 2,
+                            dtype=np.int64)
+        for column in data.columns:
+            kind = data[column].dtype.kind
+            if kind == "f":
+                # DOUBLE '<repr>', the longest repr of a double has 24
+                # characters, NULL for the missing values
+                row_bytes += 34
+            elif kind in "iu":
+                row_bytes += 21
+            elif kind == "b":
+                row_bytes += 6
+            elif kind == "M":
+                # TIMESTAMP 'YYYY-MM-DD HH:MM:SS.ffffff', with the time zone
+                # name for the zone aware timestamps
+                tz = getattr(data[column].dtype, "tz", None)
+                row_bytes += 39 + (len(str(tz)) + 1 if tz is not None else 0)
+            else:
+                # Quoted string with the quotes inside doubled, the size in
+                # bytes bounds the number of characters, NULL for None
+                values = data[column].astype(str)
+                row_bytes += np.maximum(
+                    values.str.encode("utf-8").str.len().to_numpy() +
+                    values.str.count("'").to_numpy() + 3, 5)
+
+        cumulative_bytes = np.cumsum(row_bytes)
+
+        batches = []
+        start = 0
+        while start < data.shape[0]:
+            offset = cumulative_bytes[start - 1] if start > 0 else 0
+            end = int(np.searchsorted(cumulative_bytes,
+                                      offset + max_statement_bytes,
+                                      side='right'))
+            # Every batch holds at least one row
+            end = max(end, start + 1)
+            batches.append((start, end))
+            start = end
+
+        return batches
 
     def upload_data_on_trino(self, schema_name, table_name, data, conn):
         """Create sql statement for inserting data and update
-        the table with data"""
+        the table with data. Data is a table or an iterable of tables.
+
+        Returns number of inserted rows, number of batches and the total
+        and maximal latency of the batches in seconds."""
+        import pandas as pd
+
+        stats = {"rows": 0, "batches": 0, "batch_seconds": 0.0,
+                 "batch_seconds_max": 0.0}
+
+        if not isinstance(data, pd.DataFrame):
+            for chunk in data:
+                chunk_stats = self.upload_data_on_trino(schema_name,
+                                                        table_name, chunk, conn)
+                stats["rows"] += chunk_stats["rows"]
+                stats["batches"] += chunk_stats["batches"]
+                stats["batch_seconds"] += chunk_stats["batch_seconds"]
+                stats["batch_seconds_max"] = max(
+                    stats["batch_seconds_max"],
+                    chunk_stats["batch_seconds_max"])
+            return stats
 
         print(data.shape[0], "rows to insert into Trino table ...")
+        stats["rows"] = data.shape[0]
+
+        if self.get_config_value("TRINO_LOAD_MODE", "insert") == "staged":
+            start_time = time.perf_counter()
+            self.upload_data_on_trino_staged(schema_name, table_name, data,
+                                             conn)
+            stats["batches"] = 1
+            stats["batch_seconds"] = stats["batch_seconds_max"] = \
+                time.perf_counter() - start_time
+            return stats
+
+        max_statement_bytes = self.get_config_value(
+            "TRINO_MAX_STATEMENT_BYTES", 1000000, int)
+
+        # Python values per column, the driver escapes them as parameters,
+        # missing numeric values are inserted as NULL
+        columns = []
+        for column in data.columns:
+            values = data[column].tolist()
+            if data[column].dtype.kind == "f" and data[column].hasnans:
+                values = [None if value != value else value
+                          for value in values]
+            columns.append(values)
+        row_placeholder = "(" + ", ".join(["?"] * len(columns)) + ")"
+
+        insert_statement = "INSERT INTO iceberg.{schema_name}.{table_name} \
+            VALUES ".format(schema_name=schema_name, table_name=table_name)
+
+        # Fixed part of the statement sent by the Trino client, the rows are
+        # counted by split_insert_batches
+        fixed_bytes = len("EXECUTE IMMEDIATE '' USING ") + \
+            len(insert_statement.encode("utf-8"))
+
+        for start, end in self.split_insert_batches(
+                data, max_statement_bytes - fixed_bytes):
+            parameters = [value for row in zip(*(column[start:end]
+                                                 for column in columns))
+                          for value in row]
 
-        batch_size = 5000
+            # Insert data into the table
+            sql_statement = insert_statement + \
+                ", ".join([row_placeholder] * (end - start))
+            start_time = time.perf_counter()
+            self.execute_sql_on_trino(sql=sql_statement, conn=conn,
+                                      parameters=parameters)
+            batch_seconds = time.perf_counter() - start_time
+
+            stats["batches"] += 1
+            stats["batch_seconds"] += batch_seconds
+            stats["batch_seconds_max"] = max(stats["batch_seconds_max"],
+                                             batch_seconds)
+
+        return stats
+
+    def upload_data_on_trino_staged(self, schema_name, table_name, data, conn):
+        """Write data as Parquet file into the staging location on the data
+        lake and add it to the Iceberg table with a single statement"""
+        import uuid
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pandas(data, preserve_index=False),
+                       buffer, compression="snappy", coerce_timestamps="us",
+                       allow_truncated_timestamps=True)
+
+        staging_prefix = self.get_config_value("TRINO_STAGING_PREFIX",
+                                               "trino_staging/")
+        location = f"{staging_prefix}{table_name}/{uuid.uuid4().hex}/"
+        self.upload_file_on_cloud(f"{location}data.parquet",
+                                  buffer.getvalue(),
+                                  "application/vnd.apache.parquet")
+
+        sql_statement = "ALTER TABLE iceberg.{schema_name}.{table_name} \
+            EXECUTE add_files(location => 's3://{bucket}/{location}', \
+            format => 'PARQUET')".format(schema_name=schema_name,
+                                         table_name=table_name,
+                                         bucket=self.__OBJ_STORAGE_BUCKET__,
+                                         location=location)
+        self.execute_sql_on_trino(sql=sql_statement, conn=conn)
+
+    def create_s3_client(self, endpoint_url, access_id, access_secret):
+        """Create S3 client with the connection pool size and the retry
+        policy from the plugin configuration"""
+        import boto3
+        from botocore.client import Config
 
-        # Iterate through pandas dataframe to extract each row values
-        for start in range(0, data.shape[0], batch_size):
-            end = start + batch_size
-            batch = data.iloc[start:end]
+        config = Config(signature_version='s3v4',
+                        max_pool_connections=self.get_config_value(
+                            "S3_MAX_POOL_CONNECTIONS", 10, int),
+                        retries={
+                            'max_attempts': self.get_config_value(
+                                "S3_MAX_ATTEMPTS", 3, int),
+                            'mode': self.get_config_value(
+                                "S3_RETRY_MODE", "standard")})
+
+        # Clients, unlike resources, are thread safe and can be shared by
+        # the workers of a batch
+        session = boto3.session.Session()
+        return session.client('s3',
+                              endpoint_url=endpoint_url,
+                              aws_access_key_id=access_id,
+                              aws_secret_access_key=access_secret,
+                              config=config,
+                              region_name=self.__OBJ_STORAGE_REGION__)
+
+    def get_s3_client(self, storage):
+        """Get the cached S3 client of the "local" MinIO instance or of the
+        "cloud" data lake, the client is created on first use"""
+        import threading
+
+        lock = self.__dict__.setdefault("__S3_CLIENTS_LOCK__", threading.Lock())
+        with lock:
+            clients = self.__dict__.setdefault("__S3_CLIENTS__", {})
+            if storage not in clients:
+                if storage == "local":
+                    clients[storage] = self.create_s3_client(
+                        self.__OBJ_STORAGE_URL_LOCAL__,
+                        self.__OBJ_STORAGE_ACCESS_ID_LOCAL__,
+                        self.__OBJ_STORAGE_ACCESS_SECRET_LOCAL__)
+                else:
+                    clients[storage] = self.create_s3_client(
+                        self.__OBJ_STORAGE_URL__,
+                        self.__OBJ_STORAGE_ACCESS_ID__,
+                        self.__OBJ_STORAGE_ACCESS_SECRET__)
 
-            # Create a batch insert statement
-            data_list = []
-            for row in batch.itertuples(index=False):
-                data_list.append(str(tuple(row)))
+            return clients[storage]
 
-            data_to_insert = ", ".join(data_list)
+    def is_missing_key(self, error):
+        """Check if the S3 client error reports a missing object"""
 
-            # Insert data into the table
-            sql_statement = "INSERT INTO iceberg.{schema_name}.{table_name} \
-                VALUES {data}".format(schema_name=schema_name,
-                                      table_name=table_name,
-                                      data=data_to_insert)
-            self.execute_sql_on_trino(sql=sql_statement, conn=conn)
+        return error.response["Error"]["Code"] in ("NoSuchKey", "404")
 
-    def download_file(self, path_download_file: str, filename:str) -> None:
-        import boto3
-        from botocore.client import Config
+    def get_transfer_config(self):
+        """Multipart transfer settings from the plugin configuration, streams
+        are uploaded in parts of the given size with parallel part transfers
+        and a bounded number of parts held in memory"""
+        from boto3.s3.transfer import TransferConfig
+
+        part_size = self.get_config_value("UPLOAD_PART_SIZE_MB", 8, int) * \
+            1024 * 1024
+
+        transfer_config = TransferConfig(multipart_threshold=part_size,
+                                         multipart_chunksize=part_size,
+                                         max_concurrency=self.get_config_value(
+                                             "UPLOAD_MAX_CONCURRENCY", 4, int))
+
+        # Not accepted by the boto3 constructor, but used by the transfer
+        # manager for streams which are not seekable
+        transfer_config.max_in_memory_upload_chunks = self.get_config_value(
+            "UPLOAD_MAX_PARTS_IN_MEMORY", 4, int)
+
+        return transfer_config
+
+    def download_file(self, path_download_file: str, filename:str) -> str:
+        """Download the file and return SHA-256 hash of its content"""
+        import hashlib
+
+        s3_local = self.get_s3_client("local")
+
+        # Download data which need to be anonymized, the hash is calculated
+        # while the data is streamed into the file. Compressed uploads are
+        # decompressed on the fly, the hash is the hash of the content.
+        file_hash = hashlib.sha256()
+        response = s3_local.get_object(Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                                       Key=filename)
+        chunks = response["Body"].iter_chunks(chunk_size=1024*1024)
+        if response.get("ContentEncoding") in ("gzip", "zstd"):
+            chunks = self.decompress_chunks(chunks,
+                                            response["ContentEncoding"])
+        with open(path_download_file, mode='wb') as file:
+            for chunk in chunks:
+                file_hash.update(chunk)
+                file.write(chunk)
+
+        return file_hash.hexdigest()
+
+    def calculate_content_hash(self, file_hash, pseudoMRN):
+        """Hash of the file content together with the pseudoMRN, the same
+        export uploaded for different patients is not a duplicate"""
+        import hashlib
+
+        content = f"{file_hash}{pseudoMRN}"
+        return hashlib.sha256(bytes(content, "utf-8")).hexdigest()
+
+    def is_content_ingested(self, content_hash):
+        """Check if the file content is already ingested, in the local cache
+        first and then in the content hash index in the local bucket"""
+        import os
+        from botocore.exceptions import ClientError
+
+        cache_file = os.path.join(self.get_config_value(
+            "DEDUP_CACHE_DIR", DEDUP_CACHE_DIR), content_hash)
+        if os.path.isfile(cache_file):
+            # Mark entry as recently used
+            os.utime(cache_file)
+            return True
+
+        try:
+            s3_local = self.get_s3_client("local")
+            response = s3_local.get_object(
+                Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                Key=f"{CONTENT_HASH_PREFIX}{content_hash}.json")
+        except ClientError as e:
+            if not self.is_missing_key(e):
+                raise
+            return False
+
+        self.cache_ingested_content(content_hash, response["Body"].read())
+
+        return True
+
+    def register_ingested_content(self, content_hash, source_name):
+        """Add the ingested file content into the content hash index and into
+        the local cache"""
+        import datetime
+        import json
+
+        record = json.dumps({"source": source_name,
+                             "ingested_on": str(datetime.datetime.now())}
+                            ).encode('utf-8')
+
+        s3_local = self.get_s3_client("local")
+        s3_local.put_object(Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                            Key=f"{CONTENT_HASH_PREFIX}{content_hash}.json",
+                            Body=record)
+
+        self.cache_ingested_content(content_hash, record)
+
+    def get_header_value(self, header, delimiter, field):
+        """Get the value of the first header line whose field name contains
+        the given field, or None if there is no such line"""
+
+        field = field.encode('utf-8')
+        for line in header:
+            cells = line.rstrip(b'\r\n').split(delimiter.encode('utf-8'))
+            if len(cells) > 1 and field in cells[0]:
+                return cells[1].strip().strip(b'"').decode('utf-8',
+                                                           errors='replace')
+
+        return None
+
+    def calculate_recording_key(self, pseudoMRN, serial_number,
+                                startdate_time):
+        """Key of the recording, which is the same for all cumulative exports
+        of the device for the patient. None if the recording can not be
+        identified."""
+        import hashlib
+
+        if pseudoMRN is None or not serial_number or startdate_time is None:
+            return None
+
+        recording = f"{pseudoMRN}{serial_number}{startdate_time.isoformat()}"
+        return hashlib.sha256(recording.encode('utf-8')).hexdigest()
+
+    def get_recording_state(self, recording_key):
+        """Get the stored state of the recording from the local bucket, or
+        None if the recording is not ingested yet"""
+        import json
+        from botocore.exceptions import ClientError
+
+        try:
+            s3_local = self.get_s3_client("local")
+            response = s3_local.get_object(
+                Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                Key=f"{RECORDINGS_PREFIX}{recording_key}.json")
+        except ClientError as e:
+            if not self.is_missing_key(e):
+                raise
+            return None
+
+        return json.loads(response["Body"].read())
+
+    def update_recording_state(self, recording_key, state):
+        """Store the state of the recording in the local bucket"""
+        import datetime
+        import json
+
+        state = dict(state, updated_on=str(datetime.datetime.now()))
+
+        s3_local = self.get_s3_client("local")
+        s3_local.put_object(Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                            Key=f"{RECORDINGS_PREFIX}{recording_key}.json",
+                            Body=json.dumps(state).encode('utf-8'))
+
+    def load_ingest_journal(self, data_info):
+        """Get the stage journal of the uploaded file, from the local folder
+        or from the local bucket. The journal is started anew if there is no
+        journal or if the uploaded file was replaced since."""
+        import datetime
+        import hashlib
+        import json
+        import os
+        from botocore.exceptions import ClientError
+
+        filename = data_info['filename']
+        key = hashlib.sha256(filename.encode('utf-8')).hexdigest()
+
+        s3_local = self.get_s3_client("local")
+        try:
+            etag = s3_local.head_object(
+                Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                Key=filename)["ETag"]
+        except ClientError as e:
+            if not self.is_missing_key(e):
+                raise
+            etag = None
+
+        content = None
+        if self.get_config_value("JOURNAL_STORE", "local") == "minio":
+            try:
+                response = s3_local.get_object(
+                    Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                    Key=f"{JOURNAL_PREFIX}{key}.json")
+                content = response["Body"].read()
+            except ClientError as e:
+                if not self.is_missing_key(e):
+                    raise
+        else:
+            journal_file = os.path.join(
+                self.get_config_value("JOURNAL_DIR", JOURNAL_DIR),
+                f"{key}.json")
+            if os.path.isfile(journal_file):
+                with open(journal_file, mode='rb') as file:
+                    content = file.read()
+
+        if content is not None:
+            journal = json.loads(content)
+            if journal["etag"] == etag:
+                return journal
+
+        return {"key": key, "filename": filename, "etag": etag,
+                "created_on": str(datetime.datetime.now()), "stages": {}}
+
+    def save_ingest_journal(self, journal):
+        """Store the stage journal, stages of the file can be journaled
+        concurrently in the pipeline mode"""
+        import json
+        import os
+        import threading
+
+        lock = self.__dict__.setdefault("__JOURNAL_LOCK__", threading.Lock())
+        with lock:
+            content = json.dumps(journal).encode('utf-8')
+
+            if self.get_config_value("JOURNAL_STORE", "local") == "minio":
+                s3_local = self.get_s3_client("local")
+                s3_local.put_object(
+                    Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                    Key=f"{JOURNAL_PREFIX}{journal['key']}.json",
+                    Body=content)
+                return
+
+            journal_dir = self.get_config_value("JOURNAL_DIR", JOURNAL_DIR)
+            os.makedirs(journal_dir, exist_ok=True)
+            journal_file = os.path.join(journal_dir, f"{journal['key']}.json")
+            # Replace the journal atomically, a crash never leaves a partial
+            # journal behind
+            with open(f"{journal_file}.tmp", mode='wb') as file:
+                file.write(content)
+            os.replace(f"{journal_file}.tmp", journal_file)
+
+    def remove_ingest_journal(self, journal):
+        """Remove the stage journal of the file once it is processed"""
+        import os
+
+        if self.get_config_value("JOURNAL_STORE", "local") == "minio":
+            s3_local = self.get_s3_client("local")
+            s3_local.delete_object(Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                                   Key=f"{JOURNAL_PREFIX}{journal['key']}.json")
+        else:
+            journal_file = os.path.join(
+                self.get_config_value("JOURNAL_DIR", JOURNAL_DIR),
+                f"{journal['key']}.json")
+            if os.path.exists(journal_file):
+                os.remove(journal_file)
+
+    def is_stage_completed(self, journal, stage):
+        """Check if the journal records the stage as completed"""
+
+        if journal is None:
+            return False
+
+        return journal["stages"].get(stage, {}).get("status") == "completed"
+
+    def update_journal_stage(self, journal, stage, status, **artifacts):
+        """Record the status of the stage and its artifacts in the journal.
+        Returns True if the stage was already started before."""
+        import datetime
+        import threading
+
+        lock = self.__dict__.setdefault("__JOURNAL_LOCK__", threading.Lock())
+        with lock:
+            started = stage in journal["stages"]
+            journal["stages"][stage] = dict(
+                artifacts, status=status,
+                updated_on=str(datetime.datetime.now()))
+
+        self.save_ingest_journal(journal)
+
+        return started
+
+    def delete_source_rows(self, schema_name, table_name, source_name, conn,
+                           rowids=None):
+        """Delete the rows of the source inserted by an interrupted insert,
+        so that the insert can be repeated. Only the rows within the range
+        of rowids are deleted, if it is given."""
+
+        sql_statement = "DELETE FROM iceberg.{schema_name}.{table_name} \
+            WHERE source = ?".format(schema_name=schema_name,
+                                     table_name=table_name)
+        parameters = [source_name]
+        if rowids is not None:
+            sql_statement += " AND rowid BETWEEN ? AND ?"
+            parameters += [int(min(rowids)), int(max(rowids))]
+
+        self.execute_sql_on_trino(sql=sql_statement, conn=conn,
+                                  parameters=parameters)
+
+    def scan_epoch_rows(self, path_to_file, body_offset, delimiter,
+                        last_epoch=None):
+        """Locate the epoch rows of the file, which follow the row of column
+        names. The rows are scanned from the end of the file, so that only
+        the rows after the last_epoch, given as its Date and Time cells, are
+        read.
+
+        Returns the offset of the first epoch row, the offset of the first
+        row after the last_epoch (None if the last_epoch is not found), the
+        Date and Time cells of the first row after the last_epoch and of the
+        last row and the number of rows after the last_epoch.
+        """
+        import mmap
+        import os
+
+        if os.path.getsize(path_to_file) <= body_offset:
+            raise ValueError("The actigraphy file does not contain epoch "
+                             "data.")
+
+        delimiter = delimiter.encode('utf-8')
+        with open(path_to_file, mode='rb') as file, \
+                mmap.mmap(file.fileno(), 0,
+                          access=mmap.ACCESS_READ) as mapped_file:
+            # The column names row follows the description of the columns
+            data_offset = None
+            position = body_offset
+            while data_offset is None and position < len(mapped_file):
+                end = mapped_file.find(b'\n', position) + 1 or \
+                    len(mapped_file)
+                columns = [column.strip().strip(b'"') for column in
+                           mapped_file[position:end].split(delimiter)]
+                if b'Date' in columns and b'Time' in columns:
+                    date_column = columns.index(b'Date')
+                    time_column = columns.index(b'Time')
+                    data_offset = end
+                position = end
+
+            if data_offset is None:
+                raise ValueError("The data section of the actigraphy file "
+                                 "does not contain the Date and Time "
+                                 "columns.")
+
+            first_row = None
+            last_row = None
+            append_offset = None
+            rows = 0
+            end = len(mapped_file)
+            while end > data_offset:
+                start = max(mapped_file.rfind(b'\n', data_offset, end - 1)
+                            + 1, data_offset)
+                cells = mapped_file[start:end].strip().split(delimiter)
+                if len(cells) > max(date_column, time_column):
+                    epoch = [cells[date_column].strip(b'"').decode('utf-8'),
+                             cells[time_column].strip(b'"').decode('utf-8')]
+                    if last_row is None:
+                        last_row = epoch
+                    if last_epoch is None:
+                        break
+                    if epoch == list(last_epoch):
+                        append_offset = end
+                        break
+                    first_row = epoch
+                    rows += 1
+                end = start
+
+        return data_offset, append_offset, first_row, last_row, rows
+
+    def prepare_incremental_ingest(self, path_to_file, header, body_offset,
+                                   delimiter, pseudoMRN, startdate_time,
+                                   source_name):
+        """Find the epochs of the file which are not ingested yet for its
+        recording, identified by the pseudoMRN, the serial number of the
+        device and the start of the data collection.
+
+        Returns None if the recording can not be identified. Otherwise the
+        key of the recording, its state to store once the file is ingested,
+        the source name of the ingested part, the offsets of the epoch data
+        to ingest, the time of the last ingested epoch and the times of the
+        first and last epoch of the part. The append_offset and the time of
+        the last ingested epoch are None when the whole file is ingested,
+        the part then spans the whole file.
+        """
+        import os
+        import pandas as pd
+
+        serial_number = self.get_header_value(header, delimiter,
+                                              "Serial Number")
+        recording_key = self.calculate_recording_key(pseudoMRN, serial_number,
+                                                     startdate_time)
+        if recording_key is None:
+            print("Recording can not be identified, the whole file is "
+                  "ingested ...")
+            return None
+
+        state = self.get_recording_state(recording_key)
+        data_offset, append_offset, first_epoch, last_epoch, rows = \
+            self.scan_epoch_rows(
+                path_to_file, body_offset, delimiter,
+                state["last_epoch"] if state is not None else None)
+
+        since_epoch_time = None
+        if state is not None and append_offset is not None:
+            # New epochs are ingested as the next part of the recording
+            base, extension = os.path.splitext(state["source_name"])
+            since_epoch_time = state.get("last_epoch_time")
+            state = dict(state, parts=state["parts"] + 1)
+            source_name = f"{base}.part{state['parts']:04d}{extension}"
+        else:
+            if state is not None:
+                print("Actigraphy file does not continue the stored "
+                      "recording, the whole file is ingested ...")
+            state = {"source_name": source_name, "parts": 0}
+            append_offset = None
+
+        # The last epoch of the file is the last ingested epoch once the file
+        # is ingested, its Date and Time cells are parsed as the header dates
+        # and the epochs
+        state["last_epoch"] = last_epoch
+        state["last_epoch_time"] = None
+        if last_epoch is not None:
+            state["last_epoch_time"] = \
+                self.parse_collection_time(last_epoch).isoformat()
+
+        # The part spans only its new epochs
+        part_start_time = None
+        part_end_time = None
+        if append_offset is not None and first_epoch is not None:
+            part_start_time = self.parse_collection_time(first_epoch)
+            part_end_time = pd.Timestamp(state["last_epoch_time"])
+
+        return {"key": recording_key, "state": state,
+                "source_name": source_name, "data_offset": data_offset,
+                "append_offset": append_offset, "rows": rows,
+                "since_epoch_time": since_epoch_time,
+                "start_time": part_start_time, "end_time": part_end_time}
+
+    def cache_ingested_content(self, content_hash, record):
+        """Store entry in the local cache, evicting the least recently used
+        entries when the cache is full.
+
+        The number and the size of the entries are counted in memory, the
+        cache directory is scanned only to count it on the first store and
+        to evict entries once a bound is exceeded. Entries are evicted below
+        nine tenths of the bounds, so that the scan is not repeated on every
+        following store. Entries stored by other processes are counted at
+        the next scan.
+        """
+        import os
+        import threading
+
+        cache_dir = self.get_config_value("DEDUP_CACHE_DIR", DEDUP_CACHE_DIR)
+        max_entries = self.get_config_value("DEDUP_CACHE_MAX_ENTRIES", 10000,
+                                            int)
+        max_bytes = self.get_config_value("DEDUP_CACHE_MAX_BYTES", 67108864,
+                                          int)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        lock = self.__dict__.setdefault("__DEDUP_CACHE_LOCK__",
+                                        threading.Lock())
+        with lock:
+            usage = self.__dict__.get("__DEDUP_CACHE_USAGE__")
+            if usage is None:
+                entries = list(os.scandir(cache_dir))
+                usage = [len(entries),
+                         sum(entry.stat().st_size for entry in entries)]
+
+            cache_file = os.path.join(cache_dir, content_hash)
+            try:
+                replaced_size = os.stat(cache_file).st_size
+                usage[0] -= 1
+                usage[1] -= replaced_size
+            except FileNotFoundError:
+                pass
+
+            with open(cache_file, mode='wb') as file:
+                file.write(record)
+            usage[0] += 1
+            usage[1] += len(record)
+
+            if usage[0] > max_entries or usage[1] > max_bytes:
+                entries = []
+                for entry in os.scandir(cache_dir):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        # Already evicted by a concurrent process
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                entries.sort()
+
+                usage = [len(entries), sum(entry[1] for entry in entries)]
+                for _, size, path in entries:
+                    if usage[0] <= max_entries * 0.9 and \
+                            usage[1] <= max_bytes * 0.9:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        # Already evicted by a concurrent process
+                        pass
+                    usage[0] -= 1
+                    usage[1] -= size
+
+            self.__dict__["__DEDUP_CACHE_USAGE__"] = usage
+
+    def read_filename_pid_rows(self, s3_local, key):
+        """Read the rows of a filename - patient id mapping object, without
+        the column names row"""
+        import csv
 
-        s3_local = boto3.resource('s3',
-                                  endpoint_url=self.__OBJ_STORAGE_URL_LOCAL__,
-                                  aws_access_key_id=\
-                                    self.__OBJ_STORAGE_ACCESS_ID_LOCAL__,
-                                  aws_secret_access_key=\
-                                    self.__OBJ_STORAGE_ACCESS_SECRET_LOCAL__,
-                                  config=Config(signature_version='s3v4'),
-                                  region_name=self.__OBJ_STORAGE_REGION__)
+        existing_object = s3_local.get_object(
+            Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__, Key=key)
+        existing_data = existing_object["Body"].read().decode('utf-8')
+        rows = list(csv.reader(io.StringIO(existing_data)))
 
-        # Download data which need to be anonymized
-        s3_local.Bucket(self.__OBJ_STORAGE_BUCKET_LOCAL__
-                        ).download_file(filename, path_download_file)
+        return rows[1:], existing_object["ETag"]
+
+    def write_filename_pid_rows(self, s3_local, key, rows, **conditions):
+        """Write the rows of a filename - patient id mapping object"""
+        import csv
 
-        # In order to rename the original file in bucket we need to delete
-        # it and upload it again
-        s3_local.Object(self.__OBJ_STORAGE_BUCKET_LOCAL__, filename).delete()
+        updated_data = io.StringIO()
+        csv.writer(updated_data).writerows([FILE_PID_COLUMNS] + rows)
+        s3_local.put_object(Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__, Key=key,
+                            Body=updated_data.getvalue().encode('utf-8'),
+                            **conditions)
 
     def update_filename_pid_mapping(self, obj_name, personal_id, pseudoMRN, mrn,
                                     s3_local):
-        import csv
-        import io
-
-        folder = "file_pid/"
-        filename = "filename_pid.csv"
-        file_path = f"{folder}{filename}"
-
-        bucket_local = s3_local.Bucket(self.__OBJ_STORAGE_BUCKET_LOCAL__)
-        obj_files = bucket_local.objects.filter(Prefix=folder, Delimiter="/")
-
-        if (len(list(obj_files))) > 0:
-            existing_object = s3_local.Object(self.__OBJ_STORAGE_BUCKET_LOCAL__,
-                                              file_path)
-            existing_data = existing_object.get()["Body"].read().decode('utf-8')
-            data_to_append = [obj_name, personal_id, pseudoMRN, mrn]
-            existing_rows = list(csv.reader(io.StringIO(existing_data)))
-            existing_rows.append(data_to_append)
-
-            # Update column names
-            column_names = ['filename', 'personal_id', 'pseudoMRN', 'MRN']
-            if any(col_name not in existing_rows[0] for col_name in column_names):
-                existing_rows[0] = column_names
-
-            updated_data = io.StringIO()
-            csv.writer(updated_data).writerows(existing_rows)
-            s3_local.Bucket(self.__OBJ_STORAGE_BUCKET_LOCAL__).upload_fileobj(
-                io.BytesIO(updated_data.getvalue().encode('utf-8')), file_path)
+        """Append mapping between filename and patient id.
+
+        Every ingest writes its row into a new shard object with a unique
+        name, so that concurrent ingests never overwrite each other. Shards
+        are merged into the mapping file once there are enough of them.
+        """
+        import datetime
+        import uuid
+
+        timestamp = datetime.datetime.now(datetime.timezone.utc).strftime(
+            "%Y%m%dT%H%M%S%f")
+        shard_key = f"{FILE_PID_SHARDS_PREFIX}{timestamp}_{uuid.uuid4().hex}.csv"
+
+        self.write_filename_pid_rows(s3_local, shard_key,
+                                     [[obj_name, personal_id, pseudoMRN, mrn]],
+                                     IfNoneMatch="*")
+
+        # Only check if the threshold is reached, without listing all shards
+        threshold = self.get_config_value("FILE_PID_COMPACTION_THRESHOLD", 100,
+                                          int)
+        shards = s3_local.list_objects_v2(
+            Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__,
+            Prefix=FILE_PID_SHARDS_PREFIX, MaxKeys=threshold)
+        if shards.get("KeyCount", 0) >= threshold:
+            self.compact_filename_pid_mapping(s3_local)
+
+    def compact_filename_pid_mapping(self, s3_local=None):
+        """Merge the mapping shards into the mapping file.
+
+        The mapping file is replaced only if it was not changed since it was
+        read, and shards are deleted only after they are merged, so rows are
+        never lost when compactions run concurrently. Returns the number of
+        merged shards.
+        """
+        from botocore.exceptions import ClientError
+
+        if s3_local is None:
+            s3_local = self.get_s3_client("local")
+
+        shard_keys = self.list_object_keys(s3_local,
+                                           self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                                           FILE_PID_SHARDS_PREFIX)
+        if not shard_keys:
+            return 0
+
+        try:
+            rows, etag = self.read_filename_pid_rows(s3_local, FILE_PID_MAPPING)
+            conditions = {"IfMatch": etag}
+        except ClientError as e:
+            if not self.is_missing_key(e):
+                raise
+            rows = []
+            conditions = {"IfNoneMatch": "*"}
+
+        # Skip rows that are already merged by an interrupted compaction
+        merged_rows = set(tuple(row) for row in rows)
+        for shard_key in shard_keys:
+            try:
+                shard_rows, _ = self.read_filename_pid_rows(s3_local, shard_key)
+            except ClientError as e:
+                if not self.is_missing_key(e):
+                    raise
+                # Shard was merged and removed by a concurrent compaction
+                continue
+            for row in shard_rows:
+                if tuple(row) not in merged_rows:
+                    merged_rows.add(tuple(row))
+                    rows.append(row)
+
+        try:
+            self.write_filename_pid_rows(s3_local, FILE_PID_MAPPING, rows,
+                                         **conditions)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("PreconditionFailed",
+                                                   "ConditionalRequestConflict"):
+                raise
+            print("Mapping file is compacted concurrently, skipping ...")
+            return 0
+
+        for start in range(0, len(shard_keys), 1000):
+            s3_local.delete_objects(
+                Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                Delete={"Objects": [{"Key": key} for key in
+                                    shard_keys[start:start + 1000]],
+                        "Quiet": True})
+
+        return len(shard_keys)
+
+    def get_filename_pid_index(self):
+        """Get index of the filename - patient id mapping keyed by filename
+        and by pseudoMRN.
+
+        The index is rebuilt only when the mapping file or the set of shards
+        changed since the last lookup.
+        """
+        from botocore.exceptions import ClientError
+
+        s3_local = self.get_s3_client("local")
+
+        shard_keys = self.list_object_keys(s3_local,
+                                           self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                                           FILE_PID_SHARDS_PREFIX)
+        try:
+            etag = s3_local.head_object(
+                Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                Key=FILE_PID_MAPPING)["ETag"]
+        except ClientError as e:
+            if not self.is_missing_key(e):
+                raise
+            etag = None
+
+        version = (etag, tuple(shard_keys))
+        cached_index = self.__dict__.get("__FILE_PID_INDEX__")
+        if cached_index is not None and cached_index[0] == version:
+            return cached_index[1]
+
+        rows = []
+        for key in ([FILE_PID_MAPPING] if etag is not None else []) + shard_keys:
+            try:
+                rows.extend(self.read_filename_pid_rows(s3_local, key)[0])
+            except ClientError as e:
+                if not self.is_missing_key(e):
+                    raise
+
+        index = {"filename": {}, "pseudoMRN": {}}
+        for row in rows:
+            record = dict(zip(FILE_PID_COLUMNS, row))
+            index["filename"].setdefault(record["filename"], []).append(record)
+            index["pseudoMRN"].setdefault(record["pseudoMRN"], []).append(record)
+
+        self.__dict__["__FILE_PID_INDEX__"] = (version, index)
+
+        return index
+
+    def lookup_filename_pid(self, filename=None, pseudoMRN=None):
+        """Find mapping records by filename or by pseudoMRN"""
+
+        index = self.get_filename_pid_index()
+
+        if filename is not None:
+            return index["filename"].get(filename, [])
+
+        return index["pseudoMRN"].get(pseudoMRN, [])
+
+    def read_ingest_catalog(self):
+        """Read the local index of the ingested recordings, with typed start
+        and end times, sorted by the start time. Records are appended to the
+        local file, it is compacted to the latest record of every source
+        once it holds superseded records."""
+        import os
+        import pandas as pd
+
+        path = self.get_config_value("INGEST_CATALOG_PATH",
+                                     INGEST_CATALOG_PATH)
+        if os.path.isfile(path):
+            records = pd.read_csv(path, dtype=str, keep_default_na=False,
+                                  na_values=[""])
         else:
-            key_values = ['filename', 'personal_id', 'pseudoMRN', 'MRN']
-            file_data = [key_values, [obj_name, personal_id, pseudoMRN, mrn]]
-            updated_data = io.StringIO()
-            csv.writer(updated_data).writerows(file_data)
-            s3_local.Bucket(self.__OBJ_STORAGE_BUCKET_LOCAL__).upload_fileobj(
-                io.BytesIO(updated_data.getvalue().encode('utf-8')), file_path)
+            records = pd.DataFrame(columns=INGEST_CATALOG_COLUMNS, dtype=str)
 
-    def upload_data_local(self, path_to_file, personal_id, pseudoMRN, mrn):
-        """Upload file local with inserted PID in the filename"""
+        catalog = self.index_ingest_catalog(records)
+        if len(catalog) < len(records):
+            self.write_ingest_catalog(catalog)
 
-        import boto3
-        from botocore.client import Config
+        return catalog
+
+    def get_ingest_catalog_stamp(self):
+        """Modification time and size of the local index, None if it does
+        not exist"""
+        import os
+
+        path = self.get_config_value("INGEST_CATALOG_PATH",
+                                     INGEST_CATALOG_PATH)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
+
+    def index_ingest_catalog(self, catalog):
+        """Keep the latest record of every source, with typed start and end
+        times, sorted by the start time"""
+        import pandas as pd
+
+        catalog = catalog[INGEST_CATALOG_COLUMNS].drop_duplicates(
+            "source", keep="last")
+        catalog = catalog.assign(
+            start_time=pd.to_datetime(catalog["start_time"], errors="coerce",
+                                      format="ISO8601"),
+            end_time=pd.to_datetime(catalog["end_time"], errors="coerce",
+                                    format="ISO8601"))
+
+        return catalog.sort_values("start_time", kind="stable",
+                                   ignore_index=True)
+
+    def write_ingest_catalog(self, catalog):
+        """Replace the local index of the ingested recordings at once"""
         import os
 
+        path = self.get_config_value("INGEST_CATALOG_PATH",
+                                     INGEST_CATALOG_PATH)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        catalog.to_csv(f"{path}.tmp", index=False,
+                       date_format="%Y-%m-%d %H:%M:%S")
+        os.replace(f"{path}.tmp", path)
+
+    def register_ingest_catalog_record(self, source_name, pseudoMRN,
+                                       workspace_id, startdate_time,
+                                       enddate_time, content_hash):
+        """Add the ingested recording into the local index, the cached index
+        is updated in place"""
+        import csv
+        import os
+        import threading
+        import pandas as pd
+
+        record = dict(zip(INGEST_CATALOG_COLUMNS, [
+            source_name, pseudoMRN, workspace_id,
+            None if startdate_time is None else str(startdate_time),
+            None if enddate_time is None else str(enddate_time),
+            content_hash]))
+
+        path = self.get_config_value("INGEST_CATALOG_PATH",
+                                     INGEST_CATALOG_PATH)
+        lock = self.__dict__.setdefault("__INGEST_CATALOG_LOCK__",
+                                        threading.Lock())
+        with lock:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            stamp = self.get_ingest_catalog_stamp()
+            new_file = stamp is None
+            with open(path, mode='a', newline='') as file:
+                writer = csv.writer(file)
+                if new_file:
+                    writer.writerow(INGEST_CATALOG_COLUMNS)
+                writer.writerow([record[column]
+                                 for column in INGEST_CATALOG_COLUMNS])
+
+            # The cached index keeps the stamp of the local file only if the
+            # file was not changed by another process in the meantime
+            cached_catalog = self.__dict__.get("__INGEST_CATALOG_INDEX__")
+            if cached_catalog is not None:
+                self.__dict__["__INGEST_CATALOG_INDEX__"] = (
+                    cached_catalog[0],
+                    self.index_ingest_catalog(pd.concat(
+                        [cached_catalog[1].astype({"start_time": object,
+                                                   "end_time": object}),
+                         pd.DataFrame([record])], ignore_index=True)),
+                    self.get_ingest_catalog_stamp()
+                    if cached_catalog[2] == stamp else None)
+
+    def refresh_ingest_catalog(self, conn=None):
+        """Refresh the local index of the ingested recordings from the Trino
+        table with a single query, bounded by the maximal number of
+        recordings. The most recently ended recordings are kept by the bound,
+        older recordings are only in the local index if ingested here.
+        Content hashes are known only for the recordings ingested here."""
+        import threading
+        import pandas as pd
+
+        schema_name = self.__OBJ_STORAGE_BUCKET__.replace("-", "_")
+        table_name = self.__OBJ_STORAGE_TABLE__.replace("-", "_")
+
+        if conn is None:
+            conn = self.connect_to_trino()
+
+        sql_statement = "SELECT source, \
+            max(CASE WHEN variable = 'pseudoMRN' THEN value END), \
+            workspace_id, \
+            max(CASE WHEN variable = 'startdate_time' THEN value END), \
+            max(CASE WHEN variable = 'enddate_time' THEN value END) \
+            FROM iceberg.{schema_name}.{table_name} \
+            WHERE variable IN ('pseudoMRN', 'startdate_time', 'enddate_time') \
+            GROUP BY source, workspace_id \
+            ORDER BY 5 DESC NULLS LAST \
+            LIMIT {max_rows}".format(
+                schema_name=schema_name, table_name=table_name,
+                max_rows=self.get_config_value("INGEST_CATALOG_MAX_ROWS",
+                                               100000, int))
+        rows = self.execute_sql_on_trino(sql=sql_statement, conn=conn)
+
+        trino_catalog = pd.DataFrame(rows, columns=INGEST_CATALOG_COLUMNS[:5],
+                                     dtype=str)
+        trino_catalog = trino_catalog.replace({"None": None})
+
+        lock = self.__dict__.setdefault("__INGEST_CATALOG_LOCK__",
+                                        threading.Lock())
+        with lock:
+            local_catalog = self.read_ingest_catalog()
+            # Records ingested here keep their content hash
+            content_hashes = local_catalog.set_index("source")["content_hash"]
+            trino_catalog["content_hash"] = \
+                trino_catalog["source"].map(content_hashes)
+            catalog = self.index_ingest_catalog(pd.concat(
+                [local_catalog.astype({"start_time": object,
+                                       "end_time": object}),
+                 trino_catalog], ignore_index=True))
+            self.write_ingest_catalog(catalog)
+            self.__dict__["__INGEST_CATALOG_INDEX__"] = (
+                time.monotonic(), catalog, self.get_ingest_catalog_stamp())
+
+        return catalog
+
+    def get_ingest_catalog(self):
+        """Get the index of the ingested recordings, cached for the time to
+        live from the plugin configuration. Expired index is read again from
+        the local file if it was changed since it was read, or refreshed from
+        Trino if set in the plugin configuration."""
+        import threading
+
+        cached_catalog = self.__dict__.get("__INGEST_CATALOG_INDEX__")
+        ttl = self.get_config_value("INGEST_CATALOG_TTL_SECONDS", 300, float)
+        if cached_catalog is not None and \
+                time.monotonic() - cached_catalog[0] < ttl:
+            return cached_catalog[1]
+
+        if self.get_config_value("INGEST_CATALOG_TRINO_REFRESH", False, bool):
+            try:
+                return self.refresh_ingest_catalog()
+            except Exception as e:
+                print("Refreshing of the ingest catalog failed with error: "
+                      + str(e))
+
+        lock = self.__dict__.setdefault("__INGEST_CATALOG_LOCK__",
+                                        threading.Lock())
+        with lock:
+            cached_catalog = self.__dict__.get("__INGEST_CATALOG_INDEX__")
+            stamp = self.get_ingest_catalog_stamp()
+            if cached_catalog is not None and stamp is not None and \
+                    cached_catalog[2] == stamp:
+                catalog = cached_catalog[1]
+            else:
+                catalog = self.read_ingest_catalog()
+                stamp = self.get_ingest_catalog_stamp()
+            self.__dict__["__INGEST_CATALOG_INDEX__"] = (
+                time.monotonic(), catalog, stamp)
+
+        return catalog
+
+    def lookup_ingest_catalog(self, pseudoMRN=None, workspace_id=None,
+                              source=None, start=None, end=None,
+                              overlap=True):
+        """Find the ingested recordings of the pseudoMRN, workspace or source
+        within the time range. Recordings which overlap the range are found
+        by default, only the recordings which lie within the range if
+        overlap is False. Returns list of records."""
+        import pandas as pd
+
+        catalog = self.get_ingest_catalog()
+
+        # Records are sorted by the start time, recordings starting after
+        # the end of the range are cut off without a scan
+        if end is not None:
+            catalog = catalog.iloc[:catalog["start_time"].searchsorted(
+                pd.Timestamp(end), side="right")]
+
+        mask = pd.Series(True, index=catalog.index)
+        if pseudoMRN is not None:
+            mask &= catalog["pseudoMRN"] == pseudoMRN
+        if workspace_id is not None:
+            mask &= catalog["workspace_id"] == workspace_id
+        if source is not None:
+            mask &= catalog["source"] == source
+        if start is not None:
+            if overlap:
+                mask &= catalog["end_time"] >= pd.Timestamp(start)
+            else:
+                mask &= catalog["start_time"] >= pd.Timestamp(start)
+        if end is not None and not overlap:
+            mask &= catalog["end_time"] <= pd.Timestamp(end)
+
+        records = catalog[mask].astype(object)
+        return records.where(records.notna(), None).to_dict("records")
+
+    def get_executor(self, name, config_key, default):
+        """Get the shared pool of threads of the given name, created on first
+        use with the number of workers from the plugin configuration. The
+        "IO" pool runs the network transfers which overlap with the
+        processing of the file, the "PIPELINE" pool runs the independent
+        uploads of the anonymized file and prefetches the downloads and the
+        "COMPRESSION" pool compresses the blocks of the uploaded streams."""
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        lock = self.__dict__.setdefault(f"__{name}_EXECUTOR_LOCK__",
+                                        threading.Lock())
+        with lock:
+            if self.__dict__.get(f"__{name}_EXECUTOR__") is None:
+                self.__dict__[f"__{name}_EXECUTOR__"] = ThreadPoolExecutor(
+                    max_workers=self.get_config_value(config_key, default,
+                                                      int))
+
+            return self.__dict__[f"__{name}_EXECUTOR__"]
+
+    def copy_data_local(self, filename, path_to_file):
+        """Rename the uploaded file in the local bucket with a server-side
+        copy, the raw file is not modified during the processing. Returns the
+        new name of the file."""
+        import os
+        from botocore.exceptions import ClientError
+
         basename = os.path.basename(path_to_file)
         file_name = f"actigraphy_files/{basename}"
 
-        s3_local = boto3.resource('s3',
-                                  endpoint_url=self.__OBJ_STORAGE_URL_LOCAL__,
-                                  aws_access_key_id=\
-                                    self.__OBJ_STORAGE_ACCESS_ID_LOCAL__,
-                                  aws_secret_access_key=\
-                                    self.__OBJ_STORAGE_ACCESS_SECRET_LOCAL__,
-                                  config=Config(signature_version='s3v4'),
-                                  region_name=self.__OBJ_STORAGE_REGION__)
+        s3_local = self.get_s3_client("local")
+
+        try:
+            s3_local.copy({"Bucket": self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                           "Key": filename},
+                          self.__OBJ_STORAGE_BUCKET_LOCAL__, file_name,
+                          Config=self.get_transfer_config())
+        except ClientError as e:
+            if not self.is_missing_key(e):
+                raise
+            # Uploaded file is not in the bucket anymore, upload the
+            # downloaded copy
+            s3_local.upload_file(path_to_file,
+                                 self.__OBJ_STORAGE_BUCKET_LOCAL__, file_name,
+                                 Config=self.get_transfer_config())
+
+        return file_name
+
+    def upload_data_local(self, path_to_file, personal_id, pseudoMRN, mrn,
+                          local_copy=None):
+        """Upload file local with inserted PID in the filename. If the file
+        is already copied in the local bucket, the future of the copy is
+        given in local_copy."""
+
+        import os
 
-        s3_local.Bucket(self.__OBJ_STORAGE_BUCKET_LOCAL__
-                        ).upload_file(path_to_file, file_name)
+        s3_local = self.get_s3_client("local")
+
+        if local_copy is not None:
+            file_name = local_copy.result()
+        else:
+            basename = os.path.basename(path_to_file)
+            file_name = f"actigraphy_files/{basename}"
+
+            s3_local.upload_file(path_to_file,
+                                 self.__OBJ_STORAGE_BUCKET_LOCAL__, file_name,
+                                 Config=self.get_transfer_config())
 
         # Update key value file with mapping between filename nad patient id,
         # this file is stored in the local MinIO instance
         self.update_filename_pid_mapping(file_name, personal_id, pseudoMRN, mrn,
                                          s3_local)
 
+    def remove_local_copy(self, local_copy):
+        """Remove the renamed file from the local bucket if the processing of
+        the file failed"""
+
+        try:
+            file_name = local_copy.result()
+        except Exception:
+            # Copy failed, there is nothing to remove
+            return
+
+        try:
+            s3_local = self.get_s3_client("local")
+            s3_local.delete_object(Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                                   Key=file_name)
+        except Exception as e:
+            print("Removing of the renamed file failed with error: " + str(e))
+
+    def list_object_keys(self, s3_client, bucket, prefix, delimiter=""):
+        """List all object keys under the prefix, page by page"""
+
+        paginator = s3_client.get_paginator("list_objects_v2")
+        keys = []
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix,
+                                       Delimiter=delimiter):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+
+        return keys
 
     def remove_tmp_actigraphy_file(self, file_path):
-        import boto3
-        from botocore.client import Config
+        s3_local = self.get_s3_client("local")
 
-        s3_local = boto3.resource('s3',
-                                  endpoint_url=self.__OBJ_STORAGE_URL_LOCAL__,
-                                  aws_access_key_id=\
-                                    self.__OBJ_STORAGE_ACCESS_ID_LOCAL__,
-                                  aws_secret_access_key=\
-                                    self.__OBJ_STORAGE_ACCESS_SECRET_LOCAL__,
-                                  config=Config(signature_version='s3v4'),
-                                  region_name=self.__OBJ_STORAGE_REGION__)
-
-        # Remove the file from the tmp folder if the file is not processed
-        # successfully
-        objs = list(s3_local.Bucket(self.__OBJ_STORAGE_BUCKET_LOCAL__).\
-                    objects.filter(Prefix="actigraphy_data_tmp/",
-                                   Delimiter="/"))
-        if len(list(objs))>0:
-            for obj in objs:
-                if obj.key in file_path:
-                    s3_local.Bucket(self.__OBJ_STORAGE_BUCKET_LOCAL__
-                                    ).objects.filter(Prefix=file_path).delete()
+        # Remove the uploaded file by its exact key, whatever its prefix, the
+        # file is renamed by the copy and it is not processed again by the
+        # next batch
+        s3_local.delete_object(Bucket=self.__OBJ_STORAGE_BUCKET_LOCAL__,
+                               Key=file_path)
 
     def generate_personal_id(self, personal_data):
         """Based on the identity, full_name and date of birth."""
@@ -199,126 +1756,357 @@ class GenericPlugin(EmptyPlugin):
         id = hashlib.sha256(bytes(personal_id, "utf-8")).hexdigest()
         return id
 
-    def upload_file_on_cloud(self, file_name, file_content, type_of_file):
-        """Upload metadata files to support FAIR templates"""
-        from io import BytesIO
-        import boto3
-        from botocore.client import Config
+    def upload_file_on_cloud(self, file_name, file_content, type_of_file,
+                             compress=False):
+        """Upload metadata files to support FAIR templates. If compress is
+        set, the content is compressed as set in the plugin configuration
+        while it is uploaded."""
+
+        s3_data_lake = self.get_s3_client("cloud")
+
+        # File content can be given as bytes or as a readable file object
+        if isinstance(file_content, bytes):
+            file_content = io.BytesIO(file_content)
+
+        extra_args = {'ContentType': type_of_file}
+        encoding = self.get_config_value("ARTIFACT_COMPRESSION") \
+            if compress else None
+        if encoding is not None:
+            file_content = IterableReader(
+                self.compress_stream(file_content, encoding))
+            extra_args['ContentEncoding'] = encoding
+
+        # Streams are uploaded in parts, without reading them whole
+        s3_data_lake.upload_fileobj(file_content, self.__OBJ_STORAGE_BUCKET__,
+                                    file_name, ExtraArgs=extra_args,
+                                    Config=self.get_transfer_config())
+
+    def compress_stream(self, file_content, encoding):
+        """Compress the readable file object into a stream of gzip or zstd
+        chunks, the blocks are compressed in parallel while the stream is
+        read"""
+        import collections
+        import gzip
+
+        threads = self.get_config_value("ARTIFACT_COMPRESSION_THREADS", 4, int)
+
+        if encoding == "zstd":
+            import zstandard
+
+            # Multi-threaded compression into a single frame
+            compressor = zstandard.ZstdCompressor(
+                level=self.get_config_value("ARTIFACT_COMPRESSION_LEVEL", 3,
+                                            int),
+                threads=threads)
+            yield from compressor.read_to_iter(
+                file_content, read_size=COMPRESSION_BLOCK_BYTES,
+                write_size=COMPRESSION_BLOCK_BYTES)
+            return
+
+        if encoding != "gzip":
+            raise ValueError(f"Unsupported artifact compression: {encoding}")
+
+        # Every block is compressed into a separate gzip member, members
+        # joined together are a valid gzip stream. Number of blocks waiting
+        # for the upload is bounded.
+        level = self.get_config_value("ARTIFACT_COMPRESSION_LEVEL", 6, int)
+        executor = self.get_executor("COMPRESSION",
+                                     "ARTIFACT_COMPRESSION_THREADS", 4)
+        pending = collections.deque()
+        while True:
+            block = file_content.read(COMPRESSION_BLOCK_BYTES)
+            if not block:
+                break
+            pending.append(executor.submit(gzip.compress, block, level,
+                                           mtime=0))
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+    def decompress_chunks(self, chunks, encoding):
+        """Decompress the stream of gzip or zstd chunks, streams of several
+        gzip members or zstd frames are decompressed whole"""
+        import zlib
+
+        if encoding == "zstd":
+            import zstandard
+
+            decompressor = zstandard.ZstdDecompressor().decompressobj(
+                read_across_frames=True)
+            for chunk in chunks:
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+            return
+
+        if encoding != "gzip":
+            raise ValueError(f"Unsupported content encoding: {encoding}")
+
+        decompressor = zlib.decompressobj(wbits=31)
+        for chunk in chunks:
+            while chunk:
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+                if not decompressor.eof:
+                    break
+                # Next member starts in the rest of the chunk
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(wbits=31)
 
-        s3_data_lake =  boto3.resource('s3',
-                                       endpoint_url=self.__OBJ_STORAGE_URL__,
-                                       aws_access_key_id=\
-                                        self.__OBJ_STORAGE_ACCESS_ID__,
-                                       aws_secret_access_key=\
-                                        self.__OBJ_STORAGE_ACCESS_SECRET__,
-                                       config=Config(signature_version='s3v4'),
-                                       region_name=self.__OBJ_STORAGE_REGION__)
+    def sniff_delimiter(self, path_to_file):
+        """Get the delimiter type from the first few KB of the file"""
+        import csv
+
+        sample_size = self.get_config_value("SNIFF_SAMPLE_BYTES", 16384, int)
+        with open(path_to_file, mode='rb') as file:
+            sample = file.read(sample_size)
 
+        # Only complete lines are used
+        if len(sample) == sample_size and b'\n' in sample:
+            sample = sample[:sample.rfind(b'\n') + 1]
 
-        s3_data_lake.Bucket(self.__OBJ_STORAGE_BUCKET__).upload_fileobj(
-            BytesIO(file_content), file_name,
-            ExtraArgs={'ContentType': type_of_file})
+        sniffer = csv.Sniffer()
+        return sniffer.sniff(sample.decode('utf-8', errors='replace'),
+                             delimiters=',;\t|').delimiter
 
+    def check_actigraphy_structure(self, path_to_file, header, body_offset,
+                                   delimiter):
+        """Cheap structural check of the actiwatch actigraphy file, based on
+        the scanned header and the beginning of the epoch data"""
 
-    def remove_subject_properties_info(self, path_to_file, delimiter):
-        """Remove all data from Subject properties section in the actiwatch
-        actigraphy files"""
+        if not header or b'Epoch-by-Epoch Data' not in header[-1]:
+            raise ValueError("Epoch-by-Epoch Data section is missing in the "
+                             "actigraphy file.")
 
-        # Read the file
+        required_columns = {'Date', 'Time', 'Activity'}
         with open(path_to_file, mode='rb') as file:
-            data = file.readlines()
+            file.seek(body_offset)
+            sample = file.read(65536).decode('utf-8', errors='replace')
+
+        # The column names row follows the description of the columns
+        for line in sample.splitlines():
+            columns = {column.strip().strip('"')
+                       for column in line.split(delimiter)}
+            if required_columns <= columns:
+                return
+
+        raise ValueError("The data section of the actigraphy file does not "
+                         "contain the required columns: "
+                         + ", ".join(sorted(required_columns)) + ".")
+
+    def map_actigraphy_file(self, path_to_file):
+        """Memory-map the file read-only when the memory-mapped mode is set
+        in the plugin configuration. Returns None otherwise and for empty
+        files, which can not be mapped."""
+        import mmap
+        import os
 
-        subject_properties = False
-        for header_offset, line in enumerate(data, 1):
-            if 'Subject Properties' in line.decode('utf-8'):
-                subject_properties = True
-                break
+        if not self.get_config_value("MMAP_MODE", False, bool) or \
+                os.path.getsize(path_to_file) == 0:
+            return None
 
-        # Read file until the next blank line
-        # First, skip blank line after section title
+        with open(path_to_file, mode='rb') as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_actigraphy_recording(self, path_to_file, delimiter,
+                                  startdate_time=None):
+        """Parse the actigraphy file with pyActigraphy, with the same order of
+        the day and month as the header dates. The recording is rejected if
+        its first epoch is not within one epoch of the given start of the
+        data collection."""
+        import pyActigraphy
+
+        raw = pyActigraphy.io.read_raw_rpx(
+            path_to_file, delimiter=delimiter,
+            dayfirst=self.get_config_value("DATE_DAYFIRST", True, bool),
+            drop_na=False)
+
+        if startdate_time is not None and len(raw.data) > 0 and \
+                abs(raw.data.index[0] - startdate_time) > raw.frequency:
+            raise ValueError(
+                "First epoch of the actigraphy file {0} does not match the "
+                "start of the data collection {1}, check the DATE_DAYFIRST "
+                "setting.".format(raw.data.index[0], startdate_time))
+
+        return raw
+
+    def get_header_redactor(self, delimiter):
+        """Get the redactor of the header fields with personal information,
+        compiled once from the rules in the plugin configuration"""
+
+        rules = self.get_config_value("REDACTION_RULES", REDACTION_RULES)
+        redactors = self.__dict__.setdefault("__HEADER_REDACTORS__", {})
+        if (rules, delimiter) not in redactors:
+            redactors[(rules, delimiter)] = HeaderRedactor(rules.split(','),
+                                                           delimiter)
+
+        return redactors[(rules, delimiter)]
+
+    def extract_collection_time(self, line, delimiter, start_time, end_time):
+        """Collect Start date, Start Time, End date and End time parts from
+        a single header line"""
+
+        line_to_check = line.lower()
+        if 'Data Collection Start Date'.lower() in line_to_check:
+            start_time.append(re.sub(r'[^\d./]+', '', line.split(delimiter)[1]))
+        elif 'Data Collection Start Time'.lower() in line_to_check:
+            start_time.append(re.sub(r'[^\d.:AMP]+', '',
+                                     line.split(delimiter)[1]))
+        elif 'Data Collection End Date'.lower() in line_to_check:
+            end_time.append(re.sub(r'[^\d./]+', '', line.split(delimiter)[1]))
+        elif 'Data Collection End Time'.lower() in line_to_check:
+            end_time.append(re.sub(r'[^\d.:AMP]+', '', line.split(delimiter)[1]))
+
+    def parse_collection_time(self, time_parts):
+        """Combine collected date and time parts into a datetime"""
+        import pandas as pd
 
-        if subject_properties:
-            for data_offset, line in enumerate(data[header_offset+1:]):
-                line_clean = line.replace(b'\r\r\n', b'\r\n')
-                if line_clean == b'\r\n':
+        if time_parts:
+            # following pyactigraphy implementation, the order of the day and
+            # month is set in the plugin configuration
+            dayfirst = self.get_config_value("DATE_DAYFIRST", True, bool)
+            return pd.to_datetime(' '.join(time_parts), dayfirst=dayfirst)
+
+        return None
+
+    def anonymize_actigraphy_file(self, path_to_file, delimiter,
+                                  redactions=None):
+        """Remove personal information from the uploaded actiwatch actigraphy
+        file.
+
+        The header is read once, line by line, until the Epoch-by-Epoch Data
+        section. In the same pass the Subject Properties section and the
+        fields matching the redaction rules are redacted and the data
+        collection start and end are extracted. The epoch data itself is not
+        read. Redacted fields are appended to the given redactions list.
+
+        Returns the anonymized header lines, the offset of the epoch data in
+        the file and the start and end datetime of the data collection.
+        """
+
+        header = []
+        start_time = []
+        end_time = []
+        redactor = self.get_header_redactor(delimiter)
+        if redactions is None:
+            redactions = []
+
+        # Subject Properties section states: not found yet, title found (the
+        # blank line after the title is skipped), inside the section, done
+        subject_properties = None
+
+        # In the memory-mapped mode the header lines are read from the mapped
+        # pages, a file without the epoch data is rejected before its lines
+        # are read
+        mapped_file = self.map_actigraphy_file(path_to_file)
+        if mapped_file is not None and \
+                mapped_file.find(b'Epoch-by-Epoch Data') < 0:
+            mapped_file.close()
+            raise ValueError("Epoch-by-Epoch Data section is missing in the "
+                             "actigraphy file.")
+
+        with mapped_file or open(path_to_file, mode='rb') as file:
+            for line_number, line in enumerate(iter(file.readline, b''),
+                                               start=1):
+                if b'Epoch-by-Epoch Data' in line:
+                    header.append(line)
                     break
-                else:
-                    line_clean = line_clean.decode('utf-8')
-                    split_data = [item for item in line_clean.split(delimiter)]
-                    key_to_replace = split_data[0]
-                    new_value = None
-                    modified_string = \
-                        f'{key_to_replace}{delimiter}{new_value}\r\n'
-                    data[header_offset+1+data_offset] = \
-                        modified_string.encode('utf-8')
-
-        return data
-
-    def remove_personal_data_from_header_info(self, data, delimiter):
-        """In case that there is personal information outside of the Subject
-        properties section remove those information also"""
-
-        key_words = ['name', 'identity', 'initials', 'street', 'address',
-                     'city', 'state', 'zip', 'country', 'phone', 'gender',
-                     'birth','age', 'zone', 'latitude', 'longitude', 'altitude',
-                     'geolocation', 'location']
-
-        for header_offset, line in enumerate(data):
-            if 'Epoch-by-Epoch Data' in line.decode('utf-8'):
-                break
-            else:
-                line = line.decode('utf-8')
-                line_to_check = line.lower()
-                for keyword in key_words:
-                    if keyword in line_to_check:
-                        split_data = [item for item in line.split(delimiter)]
-                        key_to_replace = split_data[0]
-                        new_value = None
-                        modified_string = \
-                            f'{key_to_replace}{delimiter}{new_value}\r\n'
-                        data[header_offset] = modified_string.encode('utf-8')
-                        break
 
-        return data
+                rule = None
+                if subject_properties == 'section':
+                    if line.rstrip(b'\r\n') == b'':
+                        subject_properties = 'done'
+                    else:
+                        rule = SUBJECT_PROPERTIES_RULE
+                elif subject_properties == 'title':
+                    subject_properties = 'section'
+                elif subject_properties is None and \
+                        b'Subject Properties' in line:
+                    subject_properties = 'title'
+
+                # In case that there is personal information outside of the
+                # Subject properties section remove those information also
+                if rule is None:
+                    rule = redactor.match(line)
+
+                if rule is not None:
+                    redactions.append(redactor.report(line_number, line,
+                                                      rule))
+                    line = redactor.redact(line)
+                elif COLLECTION_TIME_PATTERN.search(line):
+                    self.extract_collection_time(line.decode('utf-8'),
+                                                 delimiter, start_time,
+                                                 end_time)
+                header.append(line)
+
+            body_offset = file.tell()
+
+        startdate_time = self.parse_collection_time(start_time)
+        enddate_time = self.parse_collection_time(end_time)
+
+        return header, body_offset, startdate_time, enddate_time
+
+    def iter_anonymized_actigraphy_file(self, path_to_file, header,
+                                        body_offset, chunk_size=1024*1024,
+                                        data_offset=None, append_offset=None):
+        """Yield the anonymized header lines followed by the untouched epoch
+        data of the file, read in chunks. In the memory-mapped mode the
+        chunks are views of the mapped file, which are not copied.
+
+        When append_offset is given, the epoch rows before it are skipped,
+        the description of the epoch data up to data_offset is kept.
+        """
+
+        if append_offset is None:
+            ranges = [(body_offset, None)]
+        else:
+            ranges = [(body_offset, data_offset), (append_offset, None)]
+
+        yield from header
+
+        # The mapping is released with the last view of it, so that the
+        # consumer can hold on to the chunks
+        mapped_file = self.map_actigraphy_file(path_to_file)
+        if mapped_file is not None:
+            view = memoryview(mapped_file)
+            for start, end in ranges:
+                end = len(view) if end is None else end
+                for position in range(start, end, chunk_size):
+                    yield view[position:min(position + chunk_size, end)]
+            return
+
+        with open(path_to_file, mode='rb') as file:
+            for start, end in ranges:
+                file.seek(start)
+                remaining = None if end is None else end - start
+                while remaining is None or remaining > 0:
+                    chunk = file.read(chunk_size if remaining is None
+                                      else min(chunk_size, remaining))
+                    if not chunk:
+                        break
+                    if remaining is not None:
+                        remaining -= len(chunk)
+                    yield chunk
 
     def extract_metadata_information(self, data, delimiter):
         """Extract Start date, Start Time, End date and End time from actigraphy
-        file."""
-        import re
-        import pandas as pd
+        file lines."""
 
         start_time = []
         end_time = []
-        for header_offset, line in enumerate(data):
-            if 'Epoch-by-Epoch Data' in line.decode('utf-8'):
+        for line in data:
+            line = line.decode('utf-8')
+            if 'Epoch-by-Epoch Data' in line:
                 break
             else:
-                line = line.decode('utf-8')
-                line_to_check = line.lower()
-                if 'Data Collection Start Date'.lower() in line_to_check:
-                    start_time.append(re.sub(r'[^\d./]+', '',
-                                             line.split(delimiter)[1]))
-                elif 'Data Collection Start Time'.lower() in line_to_check:
-                    start_time.append(re.sub(r'[^\d.:AMP]+', '',
-                                             line.split(delimiter)[1]))
-                elif 'Data Collection End Date'.lower() in line_to_check:
-                    end_time.append(re.sub(r'[^\d./]+', '',
-                                           line.split(delimiter)[1]))
-                elif 'Data Collection End Time'.lower() in line_to_check:
-                    end_time.append(re.sub(r'[^\d.:AMP]+', '',
-                                           line.split(delimiter)[1]))
-
-        if start_time:
-            final_start_time = pd.to_datetime(' '.join(start_time),
-                                              dayfirst=True) # following pyactigraphy implementation
-        else:
-            final_start_time = None
-
-        if end_time:
-            final_end_time = pd.to_datetime(' '.join(end_time), dayfirst=True) # following pyactigraphy implementation
-        else:
-            final_end_time = None
+                self.extract_collection_time(line, delimiter, start_time,
+                                             end_time)
 
+        final_start_time = self.parse_collection_time(start_time)
+        final_end_time = self.parse_collection_time(end_time)
 
         return final_start_time, final_end_time
 
@@ -336,170 +2124,844 @@ class GenericPlugin(EmptyPlugin):
 
         return pseudoMRN
 
-    def anonymize_actigraphy_file(self, path_to_file, delimiter):
-        """Remove personal information from the uploaded actiwatch actigraphy
-        file"""
+    def normalize_date_of_birth(self, date_of_birth):
+        """Make unified dates, so that different formats of date doesn't
+        change the final id. The common formats are parsed directly, other
+        formats with the generic day first parser."""
+        import datetime
+        import pandas as pd
 
-        data = self.remove_subject_properties_info(path_to_file, delimiter)
-        data = self.remove_personal_data_from_header_info(data, delimiter)
+        if isinstance(date_of_birth, str):
+            for date_format in DATE_OF_BIRTH_FORMATS:
+                try:
+                    return datetime.datetime.strptime(
+                        date_of_birth.strip(), date_format).strftime(
+                            "%d-%m-%Y")
+                except ValueError:
+                    pass
+
+        return pd.to_datetime(date_of_birth, dayfirst=True).strftime(
+            "%d-%m-%Y")
+
+    def get_cached_id(self, workspace_id, key, generate):
+        """Get the ID from the bounded LRU cache of the workspace, the ID is
+        generated and cached on a miss"""
+        import collections
+        import threading
+
+        lock = self.__dict__.setdefault("__ID_CACHE_LOCK__", threading.Lock())
+        caches = self.__dict__.setdefault("__ID_CACHES__", {})
+        with lock:
+            cache = caches.setdefault(workspace_id,
+                                      collections.OrderedDict())
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+
+        value = generate()
+
+        with lock:
+            cache[key] = value
+            max_entries = self.get_config_value("ID_CACHE_MAX_ENTRIES",
+                                                10000, int)
+            while len(cache) > max_entries:
+                cache.popitem(last=False)
+
+        return value
+
+    def generate_ids(self, records):
+        """Generate the personal ID and pseudoMRN of many records with name,
+        surname, date_of_birth, unique_id, MRN and workspace_id. IDs of
+        already seen records are taken from the cache of their workspace.
+
+        Returns a dict with personal_id and pseudoMRN per record, each ID is
+        None if any of its data is missing.
+        """
 
-        return data
+        ids = []
+        for record in records:
+            workspace_id = record.get("workspace_id")
+            personal_data = [record.get('name'), record.get('surname'),
+                             record.get('date_of_birth'),
+                             record.get('unique_id')]
 
-    def action(self, input_meta: PluginExchangeMetadata = None) -> \
-        PluginActionResponse:
-        """
-        Extract epoch by epoch data from actiwatch actigraphy files.
-        Upload extracted data into the trino table.
-        """
-        import os
+            if all(data is not None for data in personal_data):
+                def generate_personal_id():
+                    # ID is created from the data: name, surname, date of
+                    # birth and national unique ID
+                    return self.generate_personal_id(
+                        personal_data[:2] +
+                        [self.normalize_date_of_birth(personal_data[2])] +
+                        personal_data[3:])
+
+                personal_id = self.get_cached_id(
+                    workspace_id,
+                    ("personal_id",) + tuple(str(data)
+                                             for data in personal_data),
+                    generate_personal_id)
+            else:
+                personal_id = None
+
+            mrn = record.get("MRN")
+            if mrn is not None and workspace_id is not None:
+                pseudoMRN = self.get_cached_id(
+                    workspace_id, ("pseudoMRN", str(mrn)),
+                    lambda: self.calculate_pseudoMRN(mrn, workspace_id))
+            else:
+                pseudoMRN = None
+
+            ids.append({"personal_id": personal_id, "pseudoMRN": pseudoMRN})
+
+        return ids
+
+    def generate_ids_frame(self, data):
+        """Generate the personal ID and pseudoMRN columns of a DataFrame with
+        name, surname, date_of_birth, unique_id, MRN and workspace_id
+        columns, for bulk re-identification. Each distinct date is parsed
+        once and each distinct value is hashed once."""
+        import hashlib
+        import numpy as np
         import pandas as pd
-        import csv
-        import pyActigraphy
 
+        def hash_values(values):
+            # Hash every distinct value once
+            unique_values = pd.unique(values.dropna())
+            hashes = {value: hashlib.sha256(value.encode("utf-8")).hexdigest()
+                      for value in unique_values}
+            return values.map(hashes).astype(object).where(values.notna(),
+                                                           None)
+
+        # Every distinct date is normalized once
+        dates = data["date_of_birth"]
+        if pd.api.types.is_datetime64_any_dtype(dates):
+            normalized_dates = dates.dt.strftime("%d-%m-%Y")
+        else:
+            normalized = {date: self.normalize_date_of_birth(date)
+                          for date in pd.unique(dates.dropna())}
+            normalized_dates = dates.map(normalized)
+
+        personal_columns = [data["name"], data["surname"], normalized_dates,
+                            data["unique_id"]]
+        missing = np.logical_or.reduce([column.isna()
+                                        for column in personal_columns])
+        personal_data = personal_columns[0].astype(str)
+        for column in personal_columns[1:]:
+            personal_data = personal_data + column.astype(str)
+
+        # Remove all whitespaces characters
+        personal_data = personal_data.str.replace(r"\s+", "", regex=True)
+
+        mrn_data = data["MRN"].astype(str) + data["workspace_id"].astype(str)
+        mrn_missing = data["MRN"].isna() | data["workspace_id"].isna()
+
+        result = data.copy()
+        result["personal_id"] = hash_values(personal_data.where(~missing))
+        result["pseudoMRN"] = hash_values(mrn_data.where(~mrn_missing))
+
+        return result
+
+    def get_config_value(self, key, default=None, value_type=str):
+        """Get an optional value from the plugin configuration, falling back
+        to the default when the key is missing or empty"""
+
+        value = self.__dict__.get(f"__{key.upper()}__")
+        if value is None or str(value).strip() == "":
+            return default
+
+        if value_type is bool:
+            return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+        return value_type(value)
+
+    def connect_to_trino(self):
+        """Initialize the connection with Trino"""
         from trino.dbapi import connect
         from trino.auth import BasicAuthentication
 
+        conn = connect(
+            host=self.__TRINO_HOST__,
+            port=self.__TRINO_PORT__,
+            http_scheme="https",
+            auth=BasicAuthentication(self.__TRINO_USER__,
+                                     self.__TRINO_PASSWORD__),
+            max_attempts=1,
+            request_timeout=600
+        )
+
+        return conn
+
+    def list_actigraphy_files(self, prefix):
+        """List object keys of the files stored under the prefix in the local
+        bucket"""
+
+        keys = self.list_object_keys(self.get_s3_client("local"),
+                                     self.__OBJ_STORAGE_BUCKET_LOCAL__, prefix)
+
+        # Skip folder placeholder objects
+        return [key for key in keys if not key.endswith("/")]
+
+    @contextlib.contextmanager
+    def measure_stage(self, stages, stage):
+        """Record wall time of the ingest stage, the stage can fill in the
+        processed bytes and rows of the yielded record"""
+
+        record = {"seconds": None, "bytes": None, "rows": None,
+                  "failed": False}
+        stages[stage] = record
+        start_time = time.perf_counter()
         try:
-            # Initialize the connection with Trino
-            conn = connect(
-                host=self.__TRINO_HOST__,
-                port=self.__TRINO_PORT__,
-                http_scheme="https",
-                auth=BasicAuthentication(self.__TRINO_USER__,
-                                        self.__TRINO_PASSWORD__),
-                max_attempts=1,
-                request_timeout=600
-            )
-
-            # Get the schema name, schema in Trino is an equivalent to a bucket in
-            # MinIO Trino doesn't allow to have "-" in schema name so it needs to be
-            # replaced with "_"
-            schema_name = self.__OBJ_STORAGE_BUCKET__.replace("-", "_")
-
-            # Get the table name
-            table_name = self.__OBJ_STORAGE_TABLE__.replace("-", "_")
-
-            path_to_data = \
-                "mescobrad_edge/plugins/actiwatch_actigraphy_plugin/actigraphy_files/"
-
-            # create temporary folder for storing downloaded files
-            os.makedirs(path_to_data, exist_ok=True)
-
-            basename = os.path.basename(input_meta.data_info['filename'])
-
-            pseudoMRN = self.calculate_pseudoMRN(
-                    input_meta.data_info["MRN"],
-                    input_meta.data_info["workspace_id"])
-
-            if pseudoMRN is not None:
-                path_processing_file = f"{path_to_data}{pseudoMRN}_{basename}"
-            else:
-                path_processing_file = f"{path_to_data}{basename}"
+            yield record
+        except Exception:
+            record["failed"] = True
+            raise
+        finally:
+            record["seconds"] = time.perf_counter() - start_time
 
-            # Download data to process
-            self.download_file(path_processing_file,
-                               input_meta.data_info['filename'])
+    @contextlib.contextmanager
+    def journal_stage(self, stages, stage, journal):
+        """Measure the ingest stage and record it in the journal, when the
+        journal is given. Yields the stage record and whether the stage was
+        started before by an interrupted processing of the file."""
 
-            # Process file
-            if os.path.isfile(path_processing_file):
-                # Get the delimiter type
-                with open(path_processing_file, mode='r') as file:
-                    data = file.read()
+        retried = False
+        if journal is not None:
+            retried = self.update_journal_stage(journal, stage, "started")
 
-                sniffer = csv.Sniffer()
-                delimiter = sniffer.sniff(data).delimiter
+        with self.measure_stage(stages, stage) as record:
+            yield record, retried
 
-                # Check if the file is compatible with pyActigraphy
-                raw = pyActigraphy.io.read_raw_rpx(path_processing_file,
-                                                   delimiter=delimiter,
-                                                   drop_na=False)
+        if journal is not None:
+            self.update_journal_stage(journal, stage, "completed",
+                                      bytes=record["bytes"],
+                                      rows=record["rows"])
 
-                # Extracting subject properties to create a PID
-                print("Extracting subject properties ...")
-                data_info = input_meta.data_info
-                if all(param is not None for param in [data_info['name'],
-                                                       data_info['surname'],
-                                                       data_info['date_of_birth'],
-                                                       data_info['unique_id']]):
+    def download_actigraphy_file(self, data_info):
+        """Download the actigraphy file to the processing folder. Returns the
+        path of the file, its pseudoMRN and the SHA-256 hash of its content.
+        The partially downloaded file is removed if the download fails.
 
-                    # Make unified dates, so that different formats of date
-                    # doesn't change the final id
-                    data_info["date_of_birth"] = pd.to_datetime(
-                        data_info["date_of_birth"], dayfirst=True)
+        In the resume mode the file kept from a failed processing is reused,
+        if the journal records its download."""
+        import os
 
-                    data_info["date_of_birth"] =\
-                        data_info["date_of_birth"].strftime("%d-%m-%Y")
+        path_to_data = \
+            "mescobrad_edge/plugins/actiwatch_actigraphy_plugin/actigraphy_files/"
 
-                    # ID is created from the data: name, surname, date of
-                    # birth and national unique ID
-                    personal_data = [data_info['name'], data_info['surname'],
-                                     data_info['date_of_birth'],
-                                     data_info['unique_id']]
+        # create temporary folder for storing downloaded files
+        os.makedirs(path_to_data, exist_ok=True)
 
-                    personal_id = self.generate_personal_id(personal_data)
+        basename = os.path.basename(data_info['filename'])
+
+        pseudoMRN = self.generate_ids([data_info])[0]["pseudoMRN"]
+
+        if pseudoMRN is not None:
+            path_processing_file = f"{path_to_data}{pseudoMRN}_{basename}"
+        else:
+            path_processing_file = f"{path_to_data}{basename}"
+
+        journal = None
+        if self.get_config_value("RESUME_MODE", False, bool):
+            journal = self.load_ingest_journal(data_info)
+            download = journal["stages"].get("download", {})
+            if self.is_stage_completed(journal, "download") and \
+                    download["path"] == path_processing_file and \
+                    os.path.isfile(path_processing_file) and \
+                    os.path.getsize(path_processing_file) == \
+                    download["bytes"]:
+                print("Actigraphy file is already downloaded, resuming ...")
+                return path_processing_file, pseudoMRN, download["file_hash"]
+
+        try:
+            file_hash = self.download_file(path_processing_file,
+                                           data_info['filename'])
+        except Exception:
+            if os.path.exists(path_processing_file):
+                os.remove(path_processing_file)
+            raise
+
+        if journal is not None:
+            self.update_journal_stage(
+                journal, "download", "completed", path=path_processing_file,
+                bytes=os.path.getsize(path_processing_file),
+                file_hash=file_hash)
+
+        return path_processing_file, pseudoMRN, file_hash
+
+    def run_uploads(self, uploads):
+        """Run the independent uploads of the processed file, concurrently in
+        the pipeline mode. All uploads are finished before the first error,
+        in the given order, is raised."""
+        from concurrent.futures import wait
+
+        if self.get_config_value("PIPELINE_MODE", "sequential") != \
+                "concurrent":
+            for upload in uploads:
+                upload()
+            return
+
+        executor = self.get_executor("PIPELINE", "PIPELINE_MAX_WORKERS", 8)
+        futures = [executor.submit(upload) for upload in uploads]
+        wait(futures)
+        for future in futures:
+            future.result()
+
+    def process_actigraphy_file(self, data_info, conn, schema_name,
+                                table_name, download=None):
+        """
+        Extract epoch by epoch data from a single actiwatch actigraphy file.
+        Upload extracted data into the trino table.
+
+        The download can be given as a future of an already started
+        download_actigraphy_file call.
+
+        In the resume mode the completed stages are recorded in the journal
+        of the file, and the file is kept if its processing fails. The next
+        processing of the file repeats only the stages which are not
+        completed, interrupted Trino inserts are replaced.
+
+        Returns the result of the processing of the file, with the wall
+        time, bytes and rows of each stage.
+        """
+        import os
+        import threading
+        import pandas as pd
+
+        stages = {}
+        result = {"filename": data_info['filename'], "status": "success",
+                  "error": None, "error_type": None, "failed_stage": None,
+                  "content_hash": None, "redactions": [], "stages": stages,
+                  "resumed_stages": []}
+        path_processing_file = None
+        local_copy = None
+        journal = None
+        resume = self.get_config_value("RESUME_MODE", False, bool)
+
+        try:
+            # Download data to process, or wait for the prefetched download
+            with self.measure_stage(stages, "download") as stage:
+                if download is not None:
+                    path_processing_file, pseudoMRN, file_hash = \
+                        download.result()
                 else:
-                    personal_id = None
+                    path_processing_file, pseudoMRN, file_hash = \
+                        self.download_actigraphy_file(data_info)
+                stage["bytes"] = os.path.getsize(path_processing_file)
+
+            if resume:
+                journal = self.load_ingest_journal(data_info)
+
+            # Skip files which are already ingested
+            dedup_enabled = self.get_config_value("DEDUP_ENABLED", False, bool)
+            content_hash = self.calculate_content_hash(file_hash, pseudoMRN)
+            result["content_hash"] = content_hash
+            if dedup_enabled and self.is_content_ingested(content_hash):
+                print("Actigraphy file is already ingested, skipping ...")
+                result["status"] = "duplicate"
+                return result
+
+            # Rename the file in the local bucket while it is processed
+            if not self.is_stage_completed(journal, "local_upload"):
+                local_copy = self.get_executor(
+                    "IO", "IO_MAX_WORKERS", 4).submit(
+                    self.copy_data_local, data_info['filename'],
+                    path_processing_file)
 
-                # Extract data from the uploaded actigraphy
-                print("Anonymization of data ...")
-                actigraphy_data = self.anonymize_actigraphy_file(
-                    path_processing_file, delimiter)
+            # Process file
+            if os.path.isfile(path_processing_file):
+                # Get the delimiter type
+                with self.measure_stage(stages, "sniff"):
+                    delimiter = self.sniff_delimiter(path_processing_file)
 
-                startdate_time, enddate_time = \
-                    self.extract_metadata_information(actigraphy_data,
-                                                      delimiter)
+                # Extract data from the uploaded actigraphy, metadata is
+                # extracted in the same pass
+                print("Anonymization of data ...")
+                with self.measure_stage(stages, "anonymization") as stage:
+                    actigraphy_header, body_offset, startdate_time, \
+                        enddate_time = self.anonymize_actigraphy_file(
+                            path_processing_file, delimiter,
+                            result["redactions"])
+                    stage["bytes"] = body_offset
+                    stage["rows"] = len(actigraphy_header)
+
+                # Check if the file is compatible with pyActigraphy, the
+                # full parse is done only if requested or if the epoch data
+                # is needed
+                with self.measure_stage(stages, "validation") as stage:
+                    self.check_actigraphy_structure(path_processing_file,
+                                                    actigraphy_header,
+                                                    body_offset, delimiter)
+                    if self.get_config_value("VALIDATION_MODE",
+                                             "full") == "full":
+                        raw = self.read_actigraphy_recording(
+                            path_processing_file, delimiter, startdate_time)
+                        stage["rows"] = len(raw.data)
+                    else:
+                        raw = None
 
-                # Insert personal id in the extracted data
-                trino_metadata = {"PID": [personal_id]}
-                trino_metadata_df = pd.DataFrame(data=trino_metadata)
+                # Extracting subject properties to create a PID
+                print("Extracting subject properties ...")
+                with self.measure_stage(stages, "personal_id"):
+                    personal_id = \
+                        self.generate_ids([data_info])[0]["personal_id"]
 
                 # Source name of the original actigraphy file
                 source_name = os.path.basename(path_processing_file)
 
+                # In the incremental mode only the epochs after the last
+                # stored epoch of the recording are ingested, as a part of
+                # the recording
+                recording = None
+                data_offset = None
+                append_offset = None
+                if self.get_config_value("INCREMENTAL_MODE", False, bool):
+                    with self.measure_stage(stages, "incremental") as stage:
+                        recording = self.prepare_incremental_ingest(
+                            path_processing_file, actigraphy_header,
+                            body_offset, delimiter, pseudoMRN,
+                            startdate_time, source_name)
+                        if recording is not None:
+                            source_name = recording["source_name"]
+                            data_offset = recording["data_offset"]
+                            append_offset = recording["append_offset"]
+                            stage["rows"] = recording["rows"]
+
+                    if append_offset is not None and recording["rows"] == 0:
+                        print("Actigraphy file has no new epochs, "
+                              "skipping ...")
+                        result["status"] = "duplicate"
+                        self.remove_local_copy(local_copy)
+                        return result
+
+                # Size of the epoch data to upload
+                body_bytes = stages["download"]["bytes"] - body_offset
+                if append_offset is not None:
+                    body_bytes = data_offset - body_offset + \
+                        stages["download"]["bytes"] - append_offset
+
                 # Metadata file name
-                if input_meta.data_info["metadata_json_file"] is not None:
+                if data_info["metadata_json_file"] is not None:
                     metadata_file_name = \
                         os.path.splitext(source_name)[0] + ".json"
                 else:
                     metadata_file_name = None
 
-                # Transform data in suitable form for updating trino table
-                data_transformed = \
-                    self.transform_input_data(trino_metadata_df,
-                                              source_name,
-                                              input_meta.data_info["workspace_id"],
-                                              pseudoMRN,
-                                              metadata_file_name,
-                                              startdate_time,
-                                              enddate_time)
+                with self.measure_stage(stages, "transform"):
+                    # Insert personal id in the extracted data
+                    trino_metadata = {"PID": [personal_id]}
+                    trino_metadata_df = pd.DataFrame(data=trino_metadata)
+
+                    # Transform data in suitable form for updating trino
+                    # table
+                    data_transformed = \
+                        self.transform_input_data(
+                            trino_metadata_df,
+                            source_name,
+                            data_info["workspace_id"],
+                            pseudoMRN,
+                            metadata_file_name,
+                            startdate_time,
+                            enddate_time,
+                            chunk_size=self.get_config_value(
+                                "TRANSFORM_CHUNK_ROWS", 100000, int))
 
                 print("Uploading data ...")
-                self.upload_data_local(path_processing_file, personal_id,
-                                       pseudoMRN, input_meta.data_info["MRN"])
-                self.upload_data_on_trino(schema_name, table_name,
-                                          data_transformed, conn)
-                obj_file_name_on_cloud = f"actigraphy_files/{source_name}"
-                self.upload_file_on_cloud(obj_file_name_on_cloud,
-                                          b''.join(actigraphy_data), "text/csv")
-
-                # Upload metadata file also
-                if input_meta.data_info["metadata_json_file"] is not None:
-                    obj_name_metadata = f"metadata_files/{metadata_file_name}"
-                    self.upload_file_on_cloud(obj_name_metadata,
-                                              input_meta.data_info["metadata_json_file"],
-                                              "text/json")
+
+                def skip_stage(stage):
+                    # Stages completed by an earlier processing of the file
+                    # are not repeated
+                    if self.is_stage_completed(journal, stage):
+                        result["resumed_stages"].append(stage)
+                        return True
+                    return False
+
+                def upload_local():
+                    if skip_stage("local_upload"):
+                        return
+                    with self.journal_stage(stages, "local_upload",
+                                            journal) as (stage, _):
+                        self.upload_data_local(path_processing_file,
+                                               personal_id, pseudoMRN,
+                                               data_info["MRN"], local_copy)
+                        stage["bytes"] = stages["download"]["bytes"]
+
+                epoch_cache = {}
+                epoch_lock = threading.Lock()
+
+                def get_epoch_data():
+                    # Epochs are extracted once for the epoch table, the
+                    # summaries and the Parquet export, which can run
+                    # concurrently in the pipeline mode
+                    with epoch_lock:
+                        if "data" not in epoch_cache:
+                            epoch_raw = raw
+                            if epoch_raw is None:
+                                epoch_raw = self.read_actigraphy_recording(
+                                    path_processing_file, delimiter,
+                                    startdate_time)
+                            epoch_data = self.extract_epoch_data(
+                                epoch_raw, source_name,
+                                data_info["workspace_id"], pseudoMRN)
+                            if recording is not None:
+                                epoch_data = self.select_new_epochs(
+                                    epoch_data, recording)
+                            epoch_cache["data"] = epoch_data
+                            epoch_cache["frequency"] = epoch_raw.frequency
+                        return epoch_cache["data"]
+
+                def upload_trino():
+                    # Rows of an interrupted insert are deleted before the
+                    # insert is repeated
+                    if not skip_stage("trino_insert"):
+                        with self.journal_stage(stages, "trino_insert",
+                                                journal) as (stage, retried):
+                            if retried:
+                                self.delete_source_rows(
+                                    schema_name, table_name, source_name,
+                                    conn, trino_metadata_df.index + 1)
+                            stage.update(self.upload_data_on_trino(
+                                schema_name, table_name, data_transformed,
+                                conn))
+
+                    # Upload epoch by epoch data into the typed table also
+                    epoch_table_name = self.get_config_value("EPOCH_TABLE")
+                    if epoch_table_name is not None and \
+                            not skip_stage("epoch_insert"):
+                        with self.journal_stage(stages, "epoch_insert",
+                                                journal) as (stage, retried):
+                            epoch_table_name = \
+                                epoch_table_name.replace("-", "_")
+                            epoch_data = get_epoch_data()
+                            self.create_epoch_table(schema_name,
+                                                    epoch_table_name, conn)
+                            if retried:
+                                self.delete_source_rows(
+                                    schema_name, epoch_table_name,
+                                    source_name, conn)
+                            stage.update(self.upload_data_on_trino(
+                                schema_name, epoch_table_name, epoch_data,
+                                conn))
+
+                    # Upload hourly and daily activity summaries into the
+                    # summary table and next to the anonymized file
+                    summary_table_name = \
+                        self.get_config_value("SUMMARY_TABLE")
+                    if summary_table_name is not None and \
+                            not skip_stage("summary"):
+                        with self.journal_stage(stages, "summary",
+                                                journal) as (stage, retried):
+                            summary_table_name = \
+                                summary_table_name.replace("-", "_")
+                            epoch_data = get_epoch_data()
+                            if len(epoch_data):
+                                summary = self.summarize_epoch_data(
+                                    epoch_data, epoch_cache["frequency"])
+                                self.create_summary_table(
+                                    schema_name, summary_table_name, conn)
+                                if retried:
+                                    self.delete_source_rows(
+                                        schema_name, summary_table_name,
+                                        source_name, conn)
+                                stage.update(self.upload_data_on_trino(
+                                    schema_name, summary_table_name,
+                                    summary, conn))
+                                stage["bytes"] = self.upload_summary_on_cloud(
+                                    summary, source_name)
+
+                def upload_cloud():
+                    # Objects are overwritten when the upload is repeated
+                    if not skip_stage("cloud_upload"):
+                        with self.journal_stage(stages, "cloud_upload",
+                                                journal) as (stage, _):
+                            obj_file_name_on_cloud = \
+                                f"actigraphy_files/{source_name}"
+                            actigraphy_data = IterableReader(
+                                self.iter_anonymized_actigraphy_file(
+                                    path_processing_file, actigraphy_header,
+                                    body_offset, data_offset=data_offset,
+                                    append_offset=append_offset))
+                            self.upload_file_on_cloud(obj_file_name_on_cloud,
+                                                      actigraphy_data,
+                                                      "text/csv",
+                                                      compress=True)
+                            stage["bytes"] = \
+                                sum(len(line) for line in actigraphy_header) \
+                                + body_bytes
+
+                    # Export epoch data as Parquet object also
+                    if self.get_config_value("PARQUET_EXPORT", False, bool) \
+                            and not skip_stage("parquet_export"):
+                        with self.journal_stage(stages, "parquet_export",
+                                                journal) as (stage, _):
+                            epoch_data = get_epoch_data()
+                            stage["rows"] = len(epoch_data)
+                            stage["bytes"] = self.export_epoch_parquet(
+                                epoch_data, actigraphy_header, delimiter,
+                                source_name, startdate_time, enddate_time)
+                            parquet_table_name = \
+                                self.get_config_value("PARQUET_TABLE")
+                            if parquet_table_name is not None:
+                                self.create_parquet_table(
+                                    schema_name,
+                                    parquet_table_name.replace("-", "_"),
+                                    conn)
+
+                    # Upload metadata file also
+                    if data_info["metadata_json_file"] is not None and \
+                            not skip_stage("metadata_upload"):
+                        with self.journal_stage(stages, "metadata_upload",
+                                                journal) as (stage, _):
+                            obj_name_metadata = \
+                                f"metadata_files/{metadata_file_name}"
+                            self.upload_file_on_cloud(
+                                obj_name_metadata,
+                                data_info["metadata_json_file"], "text/json")
+                            stage["bytes"] = \
+                                len(data_info["metadata_json_file"])
+
+                # Uploads of the anonymized data are independent of each
+                # other, in the pipeline mode they overlap
+                self.run_uploads([upload_local, upload_trino, upload_cloud])
+
+                if recording is not None:
+                    self.update_recording_state(recording["key"],
+                                                recording["state"])
+
+                if dedup_enabled:
+                    self.register_ingested_content(content_hash, source_name)
+
+                if self.get_config_value("INGEST_CATALOG", False, bool):
+                    # Part of a recording is recorded with the times of its
+                    # own epochs
+                    part_start_time = startdate_time
+                    part_end_time = enddate_time
+                    if recording is not None and \
+                            recording["start_time"] is not None:
+                        part_start_time = recording["start_time"]
+                        part_end_time = recording["end_time"]
+                    self.register_ingest_catalog_record(
+                        source_name, pseudoMRN, data_info["workspace_id"],
+                        part_start_time, part_end_time, content_hash)
 
             print("Processing of the actigraphy file is finished.")
 
         except Exception as e:
             print("Actigraphy processing failed with error: " + str(e))
+            result["status"] = "failed"
+            result["error"] = str(e)
+            result["error_type"] = type(e).__name__
+            result["failed_stage"] = next(
+                (stage for stage, record in stages.items() if record["failed"]),
+                None)
+
+            # The renamed file is kept once the local upload is completed,
+            # in the resume mode it is not repeated
+            if local_copy is not None and \
+                    not self.is_stage_completed(journal, "local_upload"):
+                self.remove_local_copy(local_copy)
 
         finally:
-            # Remove processed file
-            if os.path.exists(path_processing_file):
-                os.remove(path_processing_file)
+            if resume and result["status"] == "failed":
+                # Keep the downloaded file and the uploaded file for the
+                # next processing, which resumes from the journal
+                print("Actigraphy file is kept for resuming the processing.")
+            else:
+                # Remove processed file
+                if path_processing_file is not None and \
+                        os.path.exists(path_processing_file):
+                    os.remove(path_processing_file)
+
+                # Remove file in local bucket
+                self.remove_tmp_actigraphy_file(data_info['filename'])
+
+                if journal is not None:
+                    self.remove_ingest_journal(journal)
+
+        return result
+
+    def export_metrics(self, results):
+        """Export the per-stage metrics of the processed files as JSON lines
+        or as Prometheus text file, as set in the plugin configuration"""
+        import datetime
+        import json
+        import os
+
+        exporter = self.get_config_value("METRICS_EXPORTER")
+        if exporter is None:
+            return
+
+        path = self.get_config_value("METRICS_EXPORT_PATH",
+                                     "actigraphy_ingest_metrics")
+
+        if exporter == "jsonl":
+            created_on = str(datetime.datetime.now())
+            with open(path, mode='a') as file:
+                for result in results:
+                    file.write(json.dumps({"created_on": created_on,
+                                           **result}, default=str) + "\n")
+        elif exporter == "prometheus":
+            totals = {}
+            files = {}
+            for result in results:
+                files[result["status"]] = files.get(result["status"], 0) + 1
+                for stage, record in result["stages"].items():
+                    stage_totals = totals.setdefault(stage, {})
+                    for key in ("seconds", "bytes", "rows", "batches",
+                                "batch_seconds"):
+                        if record.get(key) is not None:
+                            stage_totals[key] = \
+                                stage_totals.get(key, 0) + record[key]
+
+            lines = ["# TYPE actigraphy_ingest_files gauge"]
+            lines += [f'actigraphy_ingest_files{{status="{status}"}} {count}'
+                      for status, count in files.items()]
+            for key in ("seconds", "bytes", "rows", "batches",
+                        "batch_seconds"):
+                lines.append(f"# TYPE actigraphy_ingest_stage_{key} gauge")
+                lines += [f'actigraphy_ingest_stage_{key}{{stage="{stage}"}} '
+                          f'{stage_totals[key]}'
+                          for stage, stage_totals in totals.items()
+                          if key in stage_totals]
+
+            # Replace the file at once, so that the collector never reads
+            # a partially written file
+            with open(f"{path}.tmp", mode='w') as file:
+                file.write("\n".join(lines) + "\n")
+            os.replace(f"{path}.tmp", path)
+
+    def connect_failed_result(self, data_info, error, download=None):
+        """Result of the file which could not be processed, because the
+        connection to Trino failed. The uploaded file and the prefetched
+        download are removed, unless they are kept for resuming."""
+        import os
+
+        print("Actigraphy processing failed with error: " + str(error))
+
+        if not self.get_config_value("RESUME_MODE", False, bool):
+            if download is not None:
+                try:
+                    os.remove(download.result()[0])
+                except Exception:
+                    pass
+            self.remove_tmp_actigraphy_file(data_info['filename'])
+
+        return {"filename": data_info['filename'], "status": "failed",
+                "error": str(error), "error_type": type(error).__name__,
+                "failed_stage": "connect", "content_hash": None,
+                "redactions": [], "stages": {}, "resumed_stages": []}
+
+    def process_actigraphy_batch(self, data_info, schema_name, table_name):
+        """Process many actigraphy files concurrently in a bounded pool of
+        worker threads.
+
+        Files are given as a list of object keys in "filenames", where each
+        entry can also be a dict overriding the shared data info for that
+        file, or as a "prefix" of the local bucket to process. Every worker
+        thread opens its own Trino connection and reuses it for the files it
+        processes.
+        """
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        shared_data_info = {key: value for key, value in data_info.items()
+                            if key not in ("filenames", "prefix")}
+
+        files = data_info.get("filenames")
+        if files is None:
+            files = self.list_actigraphy_files(data_info["prefix"])
+
+        files_data_info = []
+        for file in files:
+            file_data_info = dict(shared_data_info)
+            if isinstance(file, dict):
+                file_data_info.update(file)
+            else:
+                file_data_info["filename"] = file
+            files_data_info.append(file_data_info)
+
+        print(len(files_data_info), "actigraphy files to process ...")
+
+        connections = threading.local()
+        max_workers = self.get_config_value("BATCH_MAX_WORKERS", 4, int)
+
+        # In the pipeline mode the next files are downloaded while the
+        # current ones are processed, the number of downloaded files waiting
+        # for processing is bounded
+        pipeline = self.get_config_value("PIPELINE_MODE", "sequential") == \
+            "concurrent"
+        prefetch = max_workers + \
+            self.get_config_value("PIPELINE_PREFETCH_FILES", 1, int)
+        downloads = {}
+        downloads_lock = threading.Lock()
+
+        def get_download(index):
+            if not pipeline:
+                return None
+            with downloads_lock:
+                for next_index in range(index, min(index + prefetch,
+                                                   len(files_data_info))):
+                    if next_index not in downloads:
+                        downloads[next_index] = \
+                            self.get_executor(
+                                "PIPELINE", "PIPELINE_MAX_WORKERS", 8).submit(
+                                self.download_actigraphy_file,
+                                files_data_info[next_index])
+                return downloads[index]
+
+        def process(index):
+            download = get_download(index)
+            if getattr(connections, "conn", None) is None:
+                try:
+                    connections.conn = self.connect_to_trino()
+                except Exception as e:
+                    # The file fails on its own, the next file of the worker
+                    # connects again
+                    return self.connect_failed_result(
+                        files_data_info[index], e, download)
+            return self.process_actigraphy_file(files_data_info[index],
+                                                connections.conn,
+                                                schema_name, table_name,
+                                                download)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(process,
+                                        range(len(files_data_info))))
+
+        return results
+
+    def action(self, input_meta: PluginExchangeMetadata = None) -> \
+        PluginActionResponse:
+        """
+        Extract epoch by epoch data from actiwatch actigraphy files.
+        Upload extracted data into the trino table.
+
+        A single file is processed by default, a batch of files is processed
+        when "filenames" or "prefix" is given in the data info.
+        """
+
+        # Get the schema name, schema in Trino is an equivalent to a bucket in
+        # MinIO Trino doesn't allow to have "-" in schema name so it needs to be
+        # replaced with "_"
+        schema_name = self.__OBJ_STORAGE_BUCKET__.replace("-", "_")
+
+        # Get the table name
+        table_name = self.__OBJ_STORAGE_TABLE__.replace("-", "_")
+
+        data_info = input_meta.data_info
+
+        if data_info.get("filenames") is not None or \
+                data_info.get("prefix") is not None:
+            results = self.process_actigraphy_batch(data_info, schema_name,
+                                                    table_name)
+        else:
+            try:
+                conn = self.connect_to_trino()
+            except Exception as e:
+                results = [self.connect_failed_result(data_info, e)]
+            else:
+                results = [self.process_actigraphy_file(data_info, conn,
+                                                        schema_name,
+                                                        table_name)]
 
-            # Remove file in local bucket
-            self.remove_tmp_actigraphy_file(input_meta.data_info['filename'])
+        self.export_metrics(results)
 
-        return PluginActionResponse()
+        return PluginActionResponse(data_info={"results": results})
@@ -7,6 +7,9 @@ import os
 import shutil
 import sys
 import subprocess
+import threading
+import importlib
+import hashlib
 import virtualenv
 import configparser
 import datetime
@@ -14,9 +17,18 @@ import datetime
 
 PLUGIN_CONF_FILE_NAME = 'mescobrad_edge/plugins/actiwatch_actigraphy_plugin/plugin.config'
 PLUGIN_CONF_MAIN_SECTION = 'plugin-configuration'
+PLUGIN_REQUIREMENTS_FILE_NAME = 'mescobrad_edge/plugins/actiwatch_actigraphy_plugin/requirements.txt'
+VENV_REQUIREMENTS_HASH_FILE_NAME = '.requirements.sha256'
 PLUGIN_OUTPUT_FILE_DEST = './'
 PLUGIN_OUTPUT_FILE_NAME_FORMAT = '{plugin_name}-{timestamp}'
 
+# Per-process state shared by all plugin instances, so that a warm process
+# parses the configuration, validates and activates the venv only once
+_PROCESS_LOCK = threading.Lock()
+_CONFIG_CACHE = {}
+_ACTIVATED_VENVS = set()
+_PRELOAD_THREADS = {}
+
 @dataclass
 class PluginActionResponse():
     file_content_type: str = None
@@ -37,15 +49,53 @@ class EmptyPlugin():
 
     def __init__(self):
         # Dynamically set plugin configuration
-        config = configparser.ConfigParser()
-        config.read(PLUGIN_CONF_FILE_NAME)
-        for k in config[PLUGIN_CONF_MAIN_SECTION]:
-            self.__dict__[(f"__{k}__").upper()] = config[PLUGIN_CONF_MAIN_SECTION][k]
+        for k, v in self.__read_config__().items():
+            self.__dict__[(f"__{k}__").upper()] = v
 
         # create a venv with the requirements specification
         self.__venv_path__ = os.path.join(os.path.abspath(os.path.dirname(os.path.realpath(__file__))), ".venv")
         print(self.__venv_path__)
-        self.__setup_venv__()
+        with _PROCESS_LOCK:
+            self.__setup_venv__()
+
+        if self.__warm_start__():
+            # Activate once and import the heavy modules in the background,
+            # so that the first action does not pay for them
+            self.__activate_venv__()
+            self.__preload_modules__()
+
+    def __read_config__(self):
+        # Parse the configuration file once per modification
+        mtime = os.path.getmtime(PLUGIN_CONF_FILE_NAME) if os.path.exists(PLUGIN_CONF_FILE_NAME) else None
+        with _PROCESS_LOCK:
+            cached = _CONFIG_CACHE.get(PLUGIN_CONF_FILE_NAME)
+            if cached is None or cached[0] != mtime:
+                config = configparser.ConfigParser()
+                config.read(PLUGIN_CONF_FILE_NAME)
+                cached = (mtime, dict(config[PLUGIN_CONF_MAIN_SECTION]))
+                _CONFIG_CACHE[PLUGIN_CONF_FILE_NAME] = cached
+        return cached[1]
+
+    def __warm_start__(self):
+        value = self.__dict__.get("__WARM_START__", "")
+        return value.strip().lower() in ("1", "true", "yes", "on")
+
+    def __preload_modules__(self):
+        # Import the configured modules in a daemon thread, once per process
+        modules = [m.strip() for m in self.__dict__.get("__PRELOAD_MODULES__", "").split(",") if m.strip()]
+
+        def preload():
+            for module in modules:
+                try:
+                    importlib.import_module(module)
+                except Exception as e:
+                    print(f"Preloading of module {module} failed: {e}")
+
+        with _PROCESS_LOCK:
+            if self.__venv_path__ not in _PRELOAD_THREADS and modules:
+                thread = threading.Thread(target=preload, name="plugin-preload", daemon=True)
+                _PRELOAD_THREADS[self.__venv_path__] = thread
+                thread.start()
 
 
     def __destroy__(self):
@@ -54,20 +104,40 @@ class EmptyPlugin():
             # Remove venv
             shutil.rmtree(self.__venv_path__, ignore_errors=True)
 
+    def __requirements_hash__(self):
+        if not os.path.exists(PLUGIN_REQUIREMENTS_FILE_NAME):
+            return ""
+        with open(PLUGIN_REQUIREMENTS_FILE_NAME, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
     def __setup_venv__(self):
+        # The venv is valid only if it was built from the current requirements
+        hash_file = os.path.join(self.__venv_path__, VENV_REQUIREMENTS_HASH_FILE_NAME)
+        requirements_hash = self.__requirements_hash__()
+        if os.path.isfile(hash_file):
+            with open(hash_file) as f:
+                if f.read().strip() == requirements_hash:
+                    return
+
         # Check if venv folder exists
         if not os.path.isdir(self.__venv_path__):
             # Create new venv
             virtualenv.cli_run([self.__venv_path__])
-            # Activate venv
-            self.__activate_venv__()
-            # install pre_requisite on the venv
-            subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
+        # Activate venv
+        self.__activate_venv__()
+        # install pre_requisite on the venv
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", PLUGIN_REQUIREMENTS_FILE_NAME])
+        with open(hash_file, 'w') as f:
+            f.write(requirements_hash)
 
     def __activate_venv__(self):
-        # Activate the venv on the current process
+        # Activate the venv on the current process, only the first time
+        if self.__venv_path__ in _ACTIVATED_VENVS:
+            return
         activate_this_file = f"{self.__venv_path__}/bin/activate_this.py"
-        exec(open(activate_this_file).read())
+        with open(activate_this_file) as f:
+            exec(f.read(), {"__file__": activate_this_file})
+        _ACTIVATED_VENVS.add(self.__venv_path__)
 
     def __load__(self, input_file: PluginExchangeMetadata) -> Any:
         # Load input data
@@ -109,7 +179,8 @@ class EmptyPlugin():
             # Store the action output
             outputFileMetadata = self.__store__(output)
         else:
-            # Create an empty exchange metadata
-            outputFileMetadata = PluginExchangeMetadata()
+            # Create an exchange metadata without a file, the data info of
+            # the action is passed on
+            outputFileMetadata = PluginExchangeMetadata(data_info=output.data_info)
 
         return outputFileMetadata
@@ -0,0 +1,157 @@
+"""Redaction of the personal information in the header of actiwatch
+actigraphy files.
+
+Run from the root of the edge module:
+
+    python -m pytest mescobrad_edge/plugins/actiwatch_actigraphy_plugin/tests
+"""
+
+import os
+import sys
+
+import pytest
+
+# Root of the edge module, so that the plugin package can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, os.pardir)))
+
+from mescobrad_edge.plugins.actiwatch_actigraphy_plugin.entrypoint import \
+    GenericPlugin  # noqa: E402
+
+
+# Keywords of the substring test of the header lines before the redaction
+# rules, every line it redacted is still redacted, except for its false
+# positives in the kept fields
+BASELINE_KEYWORDS = ['name', 'identity', 'initials', 'street', 'address',
+                     'city', 'state', 'zip', 'country', 'phone', 'gender',
+                     'birth', 'age', 'zone', 'latitude', 'longitude',
+                     'altitude', 'geolocation', 'location']
+
+HEADER = [
+    ["Actiware Export File  (Version 05.00 )"],
+    ["Filename:", "0001_JSmith.awd"],
+    [],
+    ["-------------------- Subject Properties--------------------"],
+    [],
+    ["Identity:", "0001"],
+    ["Full Name:", "John Smith"],
+    ["Initials:", "JS"],
+    ["Street Address:", "1 Main Street"],
+    ["City:", "Brussels"],
+    ["State:", "Brabant"],
+    ["Zip Code:", "1000"],
+    ["Country:", "Belgium"],
+    ["Phone Number:", "+32 2 123 45 67"],
+    ["Gender:", "Male"],
+    ["Date of Birth:", "01/01/1970"],
+    ["Age (at start of data collection):", "53", "years"],
+    [],
+    ["----------------- Actiwatch Data Properties ----------------"],
+    [],
+    ["Actiwatch Type:", "Spectrum Plus"],
+    ["Actiwatch Serial Number:", "A00000S"],
+    ["Data Collection Start Date:", "06/03/2023"],
+    ["Data Collection Start Time:", "12:00:00"],
+    ["Data Collection End Date:", "06/03/2023"],
+    ["Data Collection End Time:", "12:00:45"],
+    ["Time Zone:", "(UTC+01:00) Brussels, Copenhagen, Madrid, Paris"],
+    ["Epoch Length:", "15", "seconds"],
+    # Fields outside of the Subject Properties section
+    ["ZipCode:", "1000"],
+    ["PhoneNumber:", "+32 2 123 45 67"],
+    ["StreetAddress:", "1 Main Street"],
+    ["Cities:", "Brussels"],
+    ["TimeZone:", "(UTC+01:00) Brussels"],
+    ["Ozone Exposure:", "Low"],
+    ["Ages:", "53"],
+    ["PatientAge:", "53"],
+    ["Patient", "John Smith, DOB 1970"],
+    ["Notes", "Lives on Main Street"],
+    ["Location Latitude:", "50.85"],
+    ["Average (n):", "120.5"],
+    ["Tage:", "7"],
+    [],
+]
+
+# Fields which are not personal information and are kept as they are
+KEPT_FIELDS = ["Actiwatch Type:", "Actiwatch Serial Number:",
+               "Data Collection Start Date:", "Data Collection Start Time:",
+               "Data Collection End Date:", "Data Collection End Time:",
+               "Epoch Length:", "Average (n):", "Tage:",
+               "Ozone Exposure:"]
+
+# Fields under neutral names or in CamelCase, which are redacted also
+EXTRA_REDACTED_FIELDS = ["Cities:", "PatientAge:", "Patient"]
+
+EPOCHS = [
+    ["-------------------- Epoch-by-Epoch Data -------------------"],
+    [],
+    ["Line", "Date", "Time", "Off-Wrist Status", "Activity", "Marker",
+     "White Light", "Red Light", "Green Light", "Blue Light", "Sleep/Wake",
+     "Interval Status"],
+    [],
+    ["1", "06/03/2023", "12:00:00", "0", "120", "0", "300.5", "100.1",
+     "120.2", "80.3", "1", "ACTIVE"],
+    ["2", "06/03/2023", "12:00:15", "0", "118", "0", "301.5", "101.1",
+     "121.2", "81.3", "1", "ACTIVE"],
+    ["3", "06/03/2023", "12:00:30", "0", "0", "0", "302.5", "102.1",
+     "122.2", "82.3", "0", "ACTIVE"],
+    ["4", "06/03/2023", "12:00:45", "0", "5", "0", "303.5", "103.1",
+     "123.2", "83.3", "0", "ACTIVE"],
+]
+
+
+def row(cells, delimiter):
+    return (delimiter.join(f'"{cell}"' for cell in cells) + "\r\r\n").encode(
+        'utf-8')
+
+
+def baseline_redacted(line):
+    return any(keyword in line.decode('utf-8').lower()
+               for keyword in BASELINE_KEYWORDS)
+
+
+def field_name(line, delimiter):
+    return line.split(delimiter.encode('utf-8'))[0].decode(
+        'utf-8').strip().strip('"')
+
+
+@pytest.fixture
+def plugin():
+    return object.__new__(GenericPlugin)
+
+
+@pytest.mark.parametrize("delimiter", [",", ";", "\t"])
+def test_header_redaction(plugin, tmp_path, delimiter):
+    lines = [row(cells, delimiter) for cells in HEADER + EPOCHS]
+    path = tmp_path / "actigraphy.csv"
+    path.write_bytes(b"".join(lines))
+
+    redactions = []
+    header, _, startdate_time, enddate_time = \
+        plugin.anonymize_actigraphy_file(str(path), delimiter, redactions)
+
+    redacted_fields = {field_name(line, delimiter)
+                       for line in header if line.rstrip(b'\r\n').endswith(
+                           delimiter.encode('utf-8') + b'None')}
+    assert redacted_fields == {redaction["field"]
+                               for redaction in redactions}
+
+    header_lines = lines[:len(header)]
+    for original, anonymized in zip(header_lines, header):
+        field = field_name(original, delimiter)
+        if field in KEPT_FIELDS:
+            assert anonymized == original, field
+        elif baseline_redacted(original) or field in EXTRA_REDACTED_FIELDS:
+            assert field in redacted_fields, field
+            assert anonymized == original.split(
+                delimiter.encode('utf-8'))[0] + \
+                delimiter.encode('utf-8') + b'None\r\n'
+
+    # No value of the Subject Properties section is left
+    for value in [b"John Smith", b"1 Main Street", b"01/01/1970", b"JS",
+                  b"+32 2 123 45 67", b"Brussels", b"Brabant"]:
+        assert not any(value in line for line in header), value
+
+    assert str(startdate_time) == "2023-03-06 12:00:00"
+    assert str(enddate_time) == "2023-03-06 12:00:45"
@@ -0,0 +1,132 @@
+"""Incremental ingest of cumulative exports of the same actiwatch recording.
+
+Run from the root of the edge module:
+
+    python -m pytest mescobrad_edge/plugins/actiwatch_actigraphy_plugin/tests
+"""
+
+import json
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# Root of the edge module, so that the plugin package can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, os.pardir)))
+
+from mescobrad_edge.plugins.actiwatch_actigraphy_plugin.benchmarks import \
+    actigraphy_benchmark as benchmark  # noqa: E402
+from mescobrad_edge.plugins.actiwatch_actigraphy_plugin.models.plugin \
+    import PluginExchangeMetadata  # noqa: E402
+
+moto = pytest.importorskip("moto")
+
+
+def data_info(filename):
+    return {"filename": filename, "name": None, "surname": None,
+            "date_of_birth": None, "unique_id": None, "MRN": "123",
+            "workspace_id": "ws", "metadata_json_file": None}
+
+
+@pytest.fixture
+def ingests(tmp_path, monkeypatch):
+    """Ingest the first day of the recording and then the export of the
+    first two days, both with day-first dates (06/03/2023 is 6 March)"""
+    import boto3
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "benchmark")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "benchmark")
+    monkeypatch.chdir(tmp_path)
+
+    with moto.mock_aws():
+        s3 = boto3.client("s3",
+                          region_name=benchmark.PLUGIN_CONFIG[
+                              "OBJ_STORAGE_REGION"])
+        local_bucket = benchmark.PLUGIN_CONFIG["OBJ_STORAGE_BUCKET_LOCAL"]
+        s3.create_bucket(Bucket=local_bucket)
+        s3.create_bucket(Bucket=benchmark.PLUGIN_CONFIG["OBJ_STORAGE_BUCKET"])
+
+        plugin = benchmark.create_plugin()
+        for key, value in {"INCREMENTAL_MODE": "true",
+                           "DEDUP_ENABLED": "false",
+                           "EPOCH_TABLE": "epochs",
+                           "INGEST_CATALOG": "true",
+                           "INGEST_CATALOG_PATH":
+                               str(tmp_path / "ingest_catalog.csv")}.items():
+            plugin.__dict__[f"__{key}__"] = value
+        plugin.connect_to_trino = benchmark.FakeConnection
+
+        # New epochs of every ingest, with the time they follow
+        selections = []
+        select_new_epochs = plugin.select_new_epochs
+
+        def record_selection(epoch_data, recording):
+            new_epochs = select_new_epochs(epoch_data, recording)
+            selections.append((recording["since_epoch_time"], new_epochs))
+            return new_epochs
+
+        plugin.select_new_epochs = record_selection
+
+        results = []
+        states = []
+        for days in [1, 2]:
+            path = tmp_path / f"export_{days}d.csv"
+            benchmark.generate_actigraphy_file(str(path), days, ",")
+            key = f"actigraphy_data_tmp/export_{days}d.csv"
+            s3.upload_file(str(path), local_bucket, key)
+
+            output = plugin.action(
+                PluginExchangeMetadata(data_info=data_info(key)))
+            results.append(output.data_info["results"][0])
+
+            recordings = s3.list_objects_v2(Bucket=local_bucket,
+                                            Prefix="recordings/")
+            states.append([json.loads(s3.get_object(
+                Bucket=local_bucket, Key=recording["Key"])["Body"].read())
+                for recording in recordings["Contents"]])
+
+        yield plugin, results, states, selections
+
+
+def test_incremental_ingest_of_day_first_exports(ingests):
+    _, results, states, selections = ingests
+
+    assert [result["status"] for result in results] == ["success",
+                                                        "success"]
+    assert results[1]["stages"]["incremental"]["rows"] == 5760
+
+    # The first export is ingested whole, the second only after the last
+    # epoch of the first one
+    assert [state[0]["last_epoch_time"] for state in states] == \
+        ["2023-03-07T11:59:45", "2023-03-08T11:59:45"]
+    assert states[1][0]["last_epoch"] == ["08/03/2023", "11:59:45"]
+
+    (first_since, first_epochs), (part_since, part_epochs) = selections
+    assert first_since is None
+    assert len(first_epochs) == 5760
+    assert part_since == "2023-03-07T11:59:45"
+    assert len(part_epochs) == 5760
+    assert part_epochs["epoch_time"].min() == \
+        pd.Timestamp("2023-03-07 12:00:00")
+    assert part_epochs["epoch_time"].max() == \
+        pd.Timestamp("2023-03-08 11:59:45")
+
+
+def test_ingest_catalog_lookup_of_part(ingests):
+    plugin, _, _, _ = ingests
+
+    records = plugin.lookup_ingest_catalog()
+    assert [(record["source"].split("_", 1)[1], str(record["start_time"]),
+             str(record["end_time"])) for record in records] == [
+        ("export_1d.csv", "2023-03-06 12:00:00", "2023-03-07 11:59:45"),
+        ("export_1d.part0001.csv", "2023-03-07 12:00:00",
+         "2023-03-08 11:59:45")]
+
+    # The part is found by the range of its own epochs
+    records = plugin.lookup_ingest_catalog(start="2023-03-07 12:00",
+                                           end="2023-03-08 12:00",
+                                           overlap=False)
+    assert [record["source"].split("_", 1)[1] for record in records] == \
+        ["export_1d.part0001.csv"]
@@ -0,0 +1,88 @@
+"""Size of the insert statements which the Trino client sends for the
+batches of rows.
+
+Run from the root of the edge module:
+
+    python -m pytest mescobrad_edge/plugins/actiwatch_actigraphy_plugin/tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Root of the edge module, so that the plugin package can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, os.pardir)))
+
+from mescobrad_edge.plugins.actiwatch_actigraphy_plugin.entrypoint import \
+    GenericPlugin  # noqa: E402
+
+trino_dbapi = pytest.importorskip("trino.dbapi")
+
+
+class FormattingConnection():
+    """DB-API connection which formats the statements as the Trino client
+    sends them, EXECUTE IMMEDIATE with the parameters as literals"""
+
+    def __init__(self):
+        self.statements = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, parameters):
+        cursor = object.__new__(trino_dbapi.Cursor)
+        self.statements.append(
+            "EXECUTE IMMEDIATE '" + sql.replace("'", "''") + "' USING " +
+            ",".join(map(cursor._format_prepared_param, parameters)))
+
+    def fetchall(self):
+        return [[1]]
+
+
+def epoch_data(rows):
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame({
+        "source": "0f29d2aecec370ec1f420b28e4b8d03356b874914b072d4630a32a3d8a"
+                  "ac0183_export.csv",
+        "pseudomrn": "0f29d2aecec370ec1f420b28e4b8d03356b874914b072d4630a32a"
+                     "3d8aac0183",
+        "workspace_id": "ws",
+        "epoch_time": pd.date_range("2023-03-06 12:00", periods=rows,
+                                    freq="15s"),
+        "activity": rng.poisson(120, rows).astype(float),
+        "white_light": rng.gamma(2.0, 150.0, rows),
+        "red_light": rng.gamma(2.0, 50.0, rows) / 3,
+        "green_light": rng.random(rows) * 1e-7,
+        "off_wrist": (rng.random(rows) < 0.01).astype(float)})
+    data.loc[data.index % 97 == 0, "red_light"] = np.nan
+
+    return data
+
+
+def text_data(rows):
+    return pd.DataFrame({
+        "source": [f"patient's file {row} – été" for row in range(rows)],
+        "value": [None if row % 5 == 0 else "O'Brien " * (row % 7)
+                  for row in range(rows)],
+        "line": np.arange(rows)})
+
+
+@pytest.mark.parametrize("data, max_statement_bytes", [
+    (epoch_data(40000), 1000000),
+    (epoch_data(5000), 20000),
+    (text_data(20000), 100000)])
+def test_insert_statements_stay_under_the_budget(data, max_statement_bytes):
+    plugin = object.__new__(GenericPlugin)
+    plugin.__dict__["__TRINO_MAX_STATEMENT_BYTES__"] = max_statement_bytes
+    conn = FormattingConnection()
+
+    stats = plugin.upload_data_on_trino("schema", "table", data, conn)
+
+    assert stats["rows"] == len(data)
+    assert stats["batches"] == len(conn.statements) > 1
+    assert max(len(statement.encode("utf-8"))
+               for statement in conn.statements) <= max_statement_bytes